@@ -52,9 +52,42 @@ if not CHECK_CALENDAR_PERM_FUNC:
 GET_EVENTS_FUNC = get_config('GET_EVENTS_FUNC', None)
 if not GET_EVENTS_FUNC:
     def get_events(request, calendar):
-        return calendar.event_set.prefetch_related('occurrence_set','rule')
+        return calendar.event_set.select_related('rule')
 
     GET_EVENTS_FUNC = get_events
 
 # URL to redirect to to after an occurrence is canceled
 OCCURRENCE_CANCEL_REDIRECT = get_config('OCCURRENCE_CANCEL_REDIRECT', None)
+
+# Whether to keep the materialized OccurrenceIndex table up to date and use it
+# to answer Period and api_occurrences windows with a single range query.
+USE_OCCURRENCE_INDEX = get_config('USE_OCCURRENCE_INDEX', False)
+
+# Number of days before and after now for which the OccurrenceIndex holds rows.
+# Windows outside of an event's indexed range fall back to rrule expansion.
+OCCURRENCE_INDEX_HORIZON = get_config('OCCURRENCE_INDEX_HORIZON', 365)
+
+# Maximum number of compiled rrule objects kept in the per-process cache.
+# Set to 0 to disable the cache.
+RRULE_CACHE_SIZE = get_config('RRULE_CACHE_SIZE', 1000)
+
+# Minimum distance (in days) between an event's current rrule dtstart and a
+# newly computed occurrence for that occurrence to become the new checkpoint.
+# Only used when ENABLE_OPTIMIZED_RRULE_GENERATION is on.
+RRULE_CHECKPOINT_DISTANCE = get_config('RRULE_CHECKPOINT_DISTANCE', 30)
+
+# Engine used to expand the occurrences of Periods and api_occurrences, either
+# 'dateutil' or 'numpy'. The numpy engine expands simple rules in one vectorized
+# pass and falls back to dateutil if numpy is not installed.
+OCCURRENCE_EXPANSION_ENGINE = get_config('OCCURRENCE_EXPANSION_ENGINE', 'dateutil')
+
+# Alias of the Django cache (see CACHES) in which Periods store their expanded
+# occurrences across requests. None disables the cache.
+PERIOD_CACHE = get_config('PERIOD_CACHE', None)
+
+# Number of seconds the occurrences of a Period are kept in PERIOD_CACHE.
+PERIOD_CACHE_TIMEOUT = get_config('PERIOD_CACHE_TIMEOUT', 3600)
+
+# Number of occurrences in a page of api_occurrences_after, which is also the
+# largest ``limit`` it accepts.
+API_OCCURRENCES_PAGE_SIZE = get_config('API_OCCURRENCES_PAGE_SIZE', 100)
@@ -0,0 +1,234 @@
+from __future__ import absolute_import
+import datetime
+import heapq
+
+import pytz
+from django.utils import timezone
+
+from schedule.conf import settings
+from schedule.models import Occurrence
+from schedule.models.events import batch_checkpoints
+from schedule.utils import OccurrenceReplacer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ENGINES = ('dateutil', 'numpy')
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def get_engine(engine=None):
+    """
+    Returns the name of the expansion engine to use for ``engine``, which
+    defaults to the OCCURRENCE_EXPANSION_ENGINE setting. The numpy engine
+    falls back to dateutil when numpy is not installed.
+    """
+    if engine is None:
+        engine = settings.OCCURRENCE_EXPANSION_ENGINE
+    if engine not in ENGINES:
+        raise ValueError("Unknown occurrence expansion engine %r" % (engine,))
+    if engine == 'numpy' and numpy is None:
+        return 'dateutil'
+    return engine
+
+
+def expand_occurrences(events, start, end, engine=None, persisted_occurrences=None):
+    """
+    Returns the occurrences of ``events`` from start to end, persisted ones
+    included, in no particular order.
+
+    The dateutil engine expands every event on its own with
+    Event.get_occurrences. The numpy engine expands all the events with a
+    fixed step rule (see Event.get_fixed_series) together as datetime64
+    arrays, so only the occurrences within the window are ever built, and
+    leaves the other events to dateutil.
+
+    Both engines load the persisted occurrences of all the events with one
+    query, see get_persisted_occurrences, unless they are given as
+    ``persisted_occurrences``.
+    """
+    events = list(events)
+    persisted = get_persisted_occurrences(events, start, end, persisted_occurrences)
+    # the events fall back to get_occurrences, write their checkpoints at once
+    with batch_checkpoints():
+        if get_engine(engine) == 'numpy':
+            return _expand_vectorized(events, start, end, persisted)
+        occurrences = []
+        for event in events:
+            occurrences += event.get_occurrences(start, end, persisted_occurrences=persisted[event.pk])
+    return occurrences
+
+
+def iter_occurrences(events, start, end, persisted_occurrences=None):
+    """
+    Returns an iterator over the occurrences of ``events`` from start to
+    end, persisted ones included, ordered by start and end. Every event is
+    expanded lazily and the expansions are merged on a heap, so occurrences
+    come out as soon as they are generated and memory is bounded by the
+    number of events and of persisted occurrences, not by the length of the
+    window.
+
+    It returns the same occurrences as expand_occurrences.
+    """
+    events = list(events)
+    persisted = get_persisted_occurrences(events, start, end, persisted_occurrences)
+    return _merge_occurrences([_iter_event_occurrences(event, start, end, persisted[event.pk])
+                               for event in events])
+
+
+def iter_occurrences_after(events, after, cursor=None, persisted_occurrences=None):
+    """
+    Returns an iterator over the occurrences of the saved ``events`` that end
+    after ``after``, persisted ones included, ordered by start, event pk and
+    original start. Unlike EventListManager.occurrences_after it can be
+    resumed: given the (start, event pk, original start) ``cursor`` of the
+    last occurrence seen, see get_occurrence_cursor, it only yields the ones
+    that come after it, and every event seeks straight to the cursor instead
+    of expanding its rule from its start.
+    """
+    events = list(events)
+    persisted = get_persisted_occurrences(events, after, None, persisted_occurrences)
+    occurrences = _merge_occurrences([_iter_event_occurrences_after(event, after, cursor, persisted[event.pk])
+                                      for event in events], key=get_occurrence_cursor)
+    if cursor is None:
+        return occurrences
+    cursor = tuple(cursor)
+    return (occurrence for occurrence in occurrences if get_occurrence_cursor(occurrence) > cursor)
+
+
+def get_occurrence_cursor(occurrence):
+    """
+    Returns the (start, event pk, original start) position of ``occurrence``
+    in the order of iter_occurrences_after.
+    """
+    return occurrence.start, occurrence.event_id, occurrence.original_start
+
+
+def _merge_occurrences(streams, key=None):
+    # heapq.merge takes no key on Python 2, so occurrences are merged on
+    # (key, stream, position) tuples and never compared themselves
+    keyed = [_key_occurrences(i, stream, key) for i, stream in enumerate(streams)]
+    for item in heapq.merge(*keyed):
+        yield item[-1]
+
+
+def _key_occurrences(i, stream, key=None):
+    for n, occurrence in enumerate(stream):
+        if key is None:
+            yield occurrence.start, occurrence.end, i, n, occurrence
+        else:
+            yield key(occurrence), i, n, occurrence
+
+
+def _iter_event_occurrences(event, start, end, persisted):
+    # Replaced occurrences may have been moved anywhere, so the persisted
+    # occurrences that show up in the window are sorted on their own and
+    # merged back into the generated ones, following OccurrenceReplacer.merge.
+    replaced = set((occurrence.original_start, occurrence.original_end) for occurrence in persisted)
+    shown = []
+    for occurrence in persisted:
+        if event._has_occurrence_at(occurrence.original_start, occurrence.original_end, start, end):
+            if occurrence.start <= end and occurrence.end >= start:
+                shown.append(occurrence)
+        elif occurrence.start < end and occurrence.end >= start and not occurrence.cancelled:
+            shown.append(occurrence)
+    shown.sort(key=lambda occurrence: (occurrence.start, occurrence.end))
+    generated = (occurrence for occurrence in event._iter_occurrence_list(start, end)
+                 if (occurrence.original_start, occurrence.original_end) not in replaced)
+    return _merge_occurrences([generated, shown])
+
+
+def _iter_event_occurrences_after(event, after, cursor, persisted):
+    # like _iter_event_occurrences, with the window running from after on
+    replaced = set((occurrence.original_start, occurrence.original_end) for occurrence in persisted)
+    shown = [occurrence for occurrence in persisted
+             if occurrence.end > after and (not occurrence.cancelled or event._has_occurrence_at(
+                 occurrence.original_start, occurrence.original_end, after, occurrence.original_start))]
+    shown.sort(key=get_occurrence_cursor)
+    seek = after - (event.end - event.start)
+    if cursor is not None:
+        seek = max(seek, cursor[0])
+    generated = (occurrence for occurrence in event._seek_occurrences(seek)
+                 if occurrence.end > after and
+                 (occurrence.original_start, occurrence.original_end) not in replaced)
+    return _merge_occurrences([generated, shown], key=get_occurrence_cursor)
+
+
+def get_persisted_occurrences(events, start, end, occurrences=None):
+    """
+    Returns the persisted occurrences of ``events`` that can show up between
+    start and end, or after start if end is None, grouped by event pk. These
+    are the ones now in the window and the ones that were moved from it,
+    which must still replace their generated counterparts. They are loaded
+    with a single query unless a superset of them is given as
+    ``occurrences``.
+    """
+    persisted = dict((event.pk, []) for event in events)
+    pks = [pk for pk in persisted if pk is not None]
+    if not pks:
+        return persisted
+    events = dict((event.pk, event) for event in events)
+    if occurrences is None:
+        occurrences = Occurrence.objects.in_window(start, end).filter(event__in=pks)
+    for occurrence in occurrences:
+        if occurrence.event_id not in events:
+            continue
+        occurrence.event = events[occurrence.event_id]
+        persisted[occurrence.event_id].append(occurrence)
+    return persisted
+
+
+def _to_naive_utc(dt):
+    if timezone.is_aware(dt):
+        return dt.astimezone(pytz.utc).replace(tzinfo=None)
+    return dt
+
+
+def _to_microseconds(datetimes):
+    return numpy.array([_to_naive_utc(dt) for dt in datetimes], dtype='datetime64[us]').view('int64')
+
+
+def _expand_vectorized(events, start, end, persisted):
+    occurrences = []
+    vectorized = []
+    for event in events:
+        series = event.get_fixed_series()
+        # dateutil would refuse to compare naive and aware dates anyway
+        if (series is None or event.pk is None or
+                timezone.is_aware(series.dtstart) != timezone.is_aware(start)):
+            occurrences += event.get_occurrences(start, end, persisted_occurrences=persisted[event.pk])
+        else:
+            vectorized.append((event, series))
+    if not vectorized:
+        return occurrences
+
+    dtstarts = _to_microseconds(series.dtstart for event, series in vectorized)
+    steps = numpy.array([series.step for event, series in vectorized], dtype='timedelta64[us]').view('int64')
+    durations = numpy.array([event.end - event.start for event, series in vectorized],
+                            dtype='timedelta64[us]').view('int64')
+    limits = _to_microseconds(
+        min(end, series.until) if series.until is not None else end for event, series in vectorized)
+
+    # same window as Event._get_occurrence_list: start - duration <= o_start <= end
+    after = _to_microseconds([start])[0] - durations
+    first = numpy.maximum(-((dtstarts - after) // steps), 0)
+    last = (limits - dtstarts) // steps
+    counts = numpy.maximum(last - first + 1, 0)
+
+    rows = numpy.repeat(numpy.arange(len(vectorized)), counts)
+    offsets = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    o_starts = dtstarts[rows] + (first[rows] + offsets) * steps[rows]
+
+    generated = [[] for _ in vectorized]
+    for row, o_start in zip(rows.tolist(), o_starts.tolist()):
+        event, series = vectorized[row]
+        o_start = (EPOCH + datetime.timedelta(microseconds=o_start)).replace(tzinfo=series.dtstart.tzinfo)
+        generated[row].append(event._create_occurrence(o_start, o_start + (event.end - event.start)))
+
+    for (event, series), event_occurrences in zip(vectorized, generated):
+        occ_replacer = OccurrenceReplacer(persisted[event.pk])
+        occurrences += occ_replacer.merge(event_occurrences, start, end)
+    return occurrences
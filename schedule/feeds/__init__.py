@@ -4,6 +4,7 @@ from django.contrib.syndication.views import Feed, FeedDoesNotExist
 from django.core.exceptions import ObjectDoesNotExist
 from django.conf import settings
 from schedule.feeds.icalendar import ICalendarFeed
+from schedule.utils import calendar_condition
 from django.http import HttpResponse
 import datetime, itertools
 from django.utils import timezone
@@ -11,6 +12,11 @@ from django.utils import timezone
 class UpcomingEventsFeed(Feed):
     feed_id = "upcoming"
 
+    def __call__(self, request, *args, **kwargs):
+        view = super(UpcomingEventsFeed, self).__call__
+        return calendar_condition(lambda request, calendar_id, *args, **kwargs: {'pk': calendar_id},
+                                  now_dependent=True)(view)(request, *args, **kwargs)
+
     def feed_title(self, obj):
         return "Upcoming Events for %s" % obj.name
 
@@ -47,6 +53,12 @@ class UpcomingEventsFeed(Feed):
 
 
 class CalendarICalendar(ICalendarFeed):
+
+    def __call__(self, request, calendar_id, *args, **kwargs):
+        view = super(CalendarICalendar, self).__call__
+        return calendar_condition(lambda request, calendar_id, *args, **kwargs: {'pk': calendar_id})(view)(
+            request, calendar_id, *args, **kwargs)
+
     def items(self):
         cal_id = self.args[1]
         cal = Calendar.objects.get(pk=cal_id)
@@ -2,6 +2,7 @@ from __future__ import absolute_import
 from django.utils.six.moves.builtins import str
 
 from django.http import HttpResponse
+from django.utils import timezone
 import icalendar
 
 EVENT_ITEMS = (
@@ -63,3 +64,21 @@ class ICalendarFeed(object):
 
     def item_created(self, item):
         pass
+
+
+def freebusy_to_ical(busy_ranges, start, end):
+    """
+    Returns an iCalendar holding a VFREEBUSY component that lists the
+    (start, end) ``busy_ranges`` of the window from start to end.
+    """
+    cal = icalendar.Calendar()
+    cal.add('prodid', '-// django-scheduler //')
+    cal.add('version', '2.0')
+    freebusy = icalendar.FreeBusy()
+    freebusy.add('dtstamp', timezone.now())
+    freebusy.add('dtstart', start)
+    freebusy.add('dtend', end)
+    for busy_range in busy_ranges:
+        freebusy.add('freebusy', busy_range, parameters={'fbtype': 'BUSY'})
+    cal.add_component(freebusy)
+    return cal.to_ical()
@@ -28,7 +28,7 @@ class EventForm(SpanForm):
 
     class Meta:
         model = Event
-        exclude = ('creator', 'created_on', 'calendar', 'recent_start')
+        exclude = ('creator', 'created_on', 'calendar')
 
 
 class OccurrenceForm(SpanForm):
@@ -0,0 +1,30 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+
+class Command(BaseCommand):
+    help = "Rebuild the OccurrenceIndex rows of events whose indexed range lags behind the horizon"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', dest='all', default=False,
+                            help='Rebuild every event, not only the stale ones.')
+
+    def handle(self, **options):
+        from schedule.models import Event, OccurrenceIndex
+
+        start, end = OccurrenceIndex.objects.get_horizon()
+        events = Event.objects.all()
+        if not options['all']:
+            # Roll the horizon forward once a day worth of it has been used up
+            events = events.filter(
+                Q(indexed_until__isnull=True) |
+                Q(indexed_until__lt=end - datetime.timedelta(days=1)))
+        count = 0
+        for event in events.iterator():
+            OccurrenceIndex.objects.rebuild_for_event(event)
+            count += 1
+        print("Rebuilt the occurrence index of %d events" % count)
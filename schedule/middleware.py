@@ -0,0 +1,24 @@
+from __future__ import absolute_import
+from django.utils import timezone
+
+from schedule.utils import get_request_timezone
+
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:
+    MiddlewareMixin = object
+
+
+class TimezoneMiddleware(MiddlewareMixin):
+    """
+    Resolves the timezone of every request once, see get_request_timezone,
+    and activates it while the request is handled so that templates show
+    local times.
+    """
+
+    def process_request(self, request):
+        timezone.activate(get_request_timezone(request))
+
+    def process_response(self, request, response):
+        timezone.deactivate()
+        return response
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from __future__ import absolute_import
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0002_event_recent_start'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='indexed_from',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='indexed_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+            preserve_default=True,
+        ),
+        migrations.CreateModel(
+            name='OccurrenceIndex',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False, verbose_name='ID', auto_created=True)),
+                ('start', models.DateTimeField(verbose_name='start')),
+                ('end', models.DateTimeField(verbose_name='end')),
+                ('original_start', models.DateTimeField(verbose_name='original start')),
+                ('cancelled', models.BooleanField(default=False, verbose_name='cancelled')),
+                ('calendar', models.ForeignKey(blank=True, null=True, to='schedule.Calendar', verbose_name='calendar')),
+                ('event', models.ForeignKey(to='schedule.Event', verbose_name='event')),
+                ('occurrence', models.ForeignKey(blank=True, null=True, to='schedule.Occurrence', verbose_name='occurrence')),
+            ],
+            options={
+                'verbose_name_plural': 'occurrence index',
+                'verbose_name': 'occurrence index',
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='occurrenceindex',
+            index_together=set([('calendar', 'start', 'end'), ('event', 'start', 'end')]),
+        ),
+    ]
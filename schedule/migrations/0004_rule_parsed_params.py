@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from __future__ import absolute_import
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import models, migrations
+
+
+def parse_rule_params(apps, schema_editor):
+    from schedule.models.rules import parse_params
+    Rule = apps.get_model('schedule', 'Rule')
+    for rule in Rule.objects.all():
+        try:
+            parsed_params = json.dumps(parse_params(rule.params))
+        except ValidationError:
+            # Left to be parsed on read until the rule is fixed and saved
+            continue
+        Rule.objects.filter(pk=rule.pk).update(parsed_params=parsed_params)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0003_occurrenceindex'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rule',
+            name='parsed_params',
+            field=models.TextField(blank=True, editable=False, null=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(parse_rule_params, migrations.RunPython.noop),
+    ]
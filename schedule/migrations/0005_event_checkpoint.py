@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from __future__ import absolute_import
+from django.db import models, migrations
+import six.moves.cPickle as pickle
+
+
+def unpickle_recent_start(apps, schema_editor):
+    Event = apps.get_model('schedule', 'Event')
+    for event in Event.objects.exclude(recent_start__isnull=True).exclude(recent_start=''):
+        payload = event.recent_start
+        if not isinstance(payload, bytes):
+            payload = payload.encode('latin-1')
+        try:
+            data = pickle.loads(payload)
+            Event.objects.filter(pk=event.pk).update(
+                checkpoint_start=data['occurrence']['start'],
+                checkpoint_end=data['occurrence']['end'],
+                checkpoint_event_start=data['event']['start'],
+                checkpoint_rule_id=data['event']['rule_id'],
+            )
+        except Exception:
+            # A checkpoint is only an optimization, unreadable ones are dropped
+            continue
+
+
+def pickle_checkpoint(apps, schema_editor):
+    Event = apps.get_model('schedule', 'Event')
+    for event in Event.objects.filter(checkpoint_start__isnull=False):
+        payload = pickle.dumps({
+            'event': {
+                'start': event.checkpoint_event_start,
+                'rule_id': event.checkpoint_rule_id,
+            },
+            'occurrence': {
+                'start': event.checkpoint_start,
+                'end': event.checkpoint_end,
+            },
+        })
+        if isinstance(payload, bytes):
+            payload = payload.decode('latin-1')
+        Event.objects.filter(pk=event.pk).update(recent_start=payload)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0004_rule_parsed_params'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='checkpoint_start',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='checkpoint_end',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='checkpoint_event_start',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='checkpoint_rule_id',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(unpickle_recent_start, pickle_checkpoint),
+        migrations.RemoveField(
+            model_name='event',
+            name='recent_start',
+        ),
+    ]
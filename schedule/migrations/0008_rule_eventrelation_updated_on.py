@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from __future__ import absolute_import
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0007_event_window_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rule',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True, null=True, verbose_name='updated on'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='eventrelation',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True, null=True, verbose_name='updated on'),
+            preserve_default=True,
+        ),
+    ]
@@ -2,5 +2,6 @@ from __future__ import absolute_import
 from schedule.models.calendars import *
 from schedule.models.events import *
 from schedule.models.rules import *
+from schedule.models.occurrence_index import *
 
 from schedule.signals import *
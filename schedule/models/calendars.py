@@ -9,7 +9,7 @@ from django.core.urlresolvers import reverse
 from django.utils.translation import ugettext_lazy as _
 from django.template.defaultfilters import slugify
 import datetime
-from schedule.utils import EventListManager
+from schedule.utils import EventListManager, find_overlaps
 from django.utils import timezone
 import six
 
@@ -178,6 +178,20 @@ class Calendar(models.Model):
     def occurrences_after(self, date=None):
         return EventListManager(self.events.all()).occurrences_after(date)
 
+    def get_conflicts(self, events, start, end):
+        """
+        Returns the (occurrence, other occurrence) pairs of the occurrences of
+        ``events`` from start to end that overlap the occurrences of the other
+        events of this calendar, see schedule.utils.find_overlaps. The events
+        need not be saved nor be on this calendar, and are not checked against
+        each other.
+        """
+        events = list(events)
+        others = self.events.exclude(pk__in=[event.pk for event in events if event.pk is not None])
+        manager = self.event_set.model.objects
+        return find_overlaps(manager.get_occurrences_for(events, start, end),
+                             manager.get_occurrences_for(others, start, end))
+
     def get_absolute_url(self):
         return reverse('calendar_home', kwargs={'calendar_slug': self.slug})
 
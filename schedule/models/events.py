@@ -1,29 +1,262 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 from django.conf import settings as django_settings
+import datetime
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 import pytz
 from dateutil import rrule
 
 from django.contrib.contenttypes.fields import GenericForeignKey
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Q, F, Case, When, Value
 from django.contrib.contenttypes.models import ContentType
 from django.core.urlresolvers import reverse
 from django.template.defaultfilters import date
+from django.utils.encoding import force_str
 from django.utils.translation import ugettext, ugettext_lazy as _
 from django.utils import timezone
 
 from schedule.conf import settings
 from schedule.models.rules import Rule
 from schedule.models.calendars import Calendar
-from schedule.utils import OccurrenceReplacer
-import six.moves.cPickle as pickle
+from schedule.utils import OccurrenceReplacer, LRUCache, find_overlaps
 from schedule.utils import get_boolean
 
+# Compiled rrules shared by every event of this process, see get_rrule.
+rrule_cache = LRUCache(settings.RRULE_CACHE_SIZE)
+
+
+def get_rrule(rule, dtstart, until=None):
+    """
+    Returns the compiled rrule of ``rule`` starting at ``dtstart``. Compiled
+    rrules are kept in ``rrule_cache`` so the params are parsed once per
+    process. dateutil's own cache is left off: it would keep every date ever
+    walked for as long as the entry lives, which is unbounded for infinite
+    rules. Seeking is left to checkpoints, see get_optimized_rrule_object.
+    """
+    key = (rule.pk, rule.params, rule.frequency, dtstart, until)
+    compiled = rrule_cache.get(key)
+    if compiled is None:
+        params = rule.get_params()
+        if until is not None and 'count' not in params:
+            params['until'] = until
+        compiled = rrule.rrule(rule.rrule_frequency(), dtstart=dtstart, **params)
+        rrule_cache.set(key, compiled)
+    return compiled
+
+
+# Rule frequencies whose occurrences are a fixed step apart when the rule has
+# no params besides interval, see get_fixed_series.
+FIXED_STEPS = {
+    'WEEKLY': datetime.timedelta(weeks=1),
+    'DAILY': datetime.timedelta(days=1),
+    'HOURLY': datetime.timedelta(hours=1),
+}
+
+
+def _microseconds(delta):
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+class FixedSeries(object):
+    """
+    The occurrences of a rule that repeats every ``step`` from ``dtstart``,
+    computed arithmetically. It answers ``after``, ``between`` and ``xafter``
+    like the equivalent rrule, but seeks straight to the requested date
+    instead of iterating from dtstart.
+    """
+
+    def __init__(self, dtstart, step, until=None):
+        # dateutil drops the microseconds of dtstart as well
+        self.dtstart = dtstart.replace(microsecond=0)
+        self.step = step
+        self.until = until
+
+    def _index(self, dt, inc):
+        """
+        Returns the index of the first occurrence at (inc) or after dt.
+        """
+        if dt < self.dtstart:
+            return 0
+        elapsed, step = _microseconds(dt - self.dtstart), _microseconds(self.step)
+        index, remainder = divmod(elapsed, step)
+        if remainder or not inc:
+            index += 1
+        return index
+
+    def xafter(self, dt, inc=False):
+        index = self._index(dt, inc)
+        while True:
+            o_start = self.dtstart + self.step * index
+            if self.until is not None and o_start > self.until:
+                return
+            yield o_start
+            index += 1
+
+    def after(self, dt, inc=False):
+        return next(self.xafter(dt, inc), None)
+
+    def between(self, after, before, inc=False):
+        o_starts = []
+        for o_start in self.xafter(after, inc):
+            if o_start > before or (not inc and o_start == before):
+                break
+            o_starts.append(o_start)
+        return o_starts
+
+
+def get_fixed_series(rule, dtstart, until=None):
+    """
+    Returns a FixedSeries for ``rule`` if its occurrences are a fixed step
+    apart, that is a WEEKLY, DAILY or HOURLY rule with no params besides
+    interval starting at a naive or UTC dtstart, and None otherwise.
+    """
+    step = FIXED_STEPS.get(rule.frequency)
+    if step is None:
+        return None
+    params = rule.get_params()
+    if set(params) - set(['interval']):
+        return None
+    # wall clock arithmetic only matches elapsed time without utc offsets
+    if timezone.is_aware(dtstart) and dtstart.utcoffset():
+        return None
+    interval = params.get('interval', 1)
+    if interval < 1:
+        return None
+    return FixedSeries(dtstart, step * interval, until)
+
+
+# Checkpoints found while expanding occurrences, waiting for flush_checkpoints.
+_pending_checkpoints = threading.local()
+
+CHECKPOINT_FIELDS = ('checkpoint_start', 'checkpoint_end', 'checkpoint_event_start', 'checkpoint_rule_id')
+
+# Number of queued checkpoints that triggers a flush_checkpoints right away.
+CHECKPOINT_QUEUE_SIZE = 500
+
+# Events written by each UPDATE of flush_checkpoints. Every event binds 29
+# parameters, which keeps the statements under the 999 that SQLite allows
+# by default before 3.32.
+CHECKPOINT_UPDATE_SIZE = 25
+
+
+def queue_checkpoint(event):
+    """
+    Schedules the current checkpoint of ``event`` to be written by the next
+    flush_checkpoints() of this thread, which happens at the end of the
+    outermost batch_checkpoints() block or once CHECKPOINT_QUEUE_SIZE
+    checkpoints are waiting.
+    """
+    if not hasattr(_pending_checkpoints, 'events'):
+        _pending_checkpoints.events = {}
+    _pending_checkpoints.events[event.pk] = dict(
+        (field, getattr(event, field)) for field in CHECKPOINT_FIELDS)
+    if len(_pending_checkpoints.events) >= CHECKPOINT_QUEUE_SIZE:
+        flush_checkpoints()
+
+
+@contextmanager
+def batch_checkpoints():
+    """
+    Defers the checkpoints queued within the block to a single
+    flush_checkpoints() when the outermost block ends. Event.get_occurrences
+    runs in such a block, so checkpoints are written wherever occurrences are
+    expanded, in requests, tasks or the shell alike, and expanding many events
+    inside one block writes all their checkpoints together. They are
+    left queued if the block raises.
+    """
+    _pending_checkpoints.depth = getattr(_pending_checkpoints, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _pending_checkpoints.depth -= 1
+    if not _pending_checkpoints.depth:
+        flush_checkpoints()
+
+
+def _chunks(items, size):
+    for offset in range(0, len(items), size):
+        yield items[offset:offset + size]
+
+
+def flush_checkpoints():
+    """
+    Writes every queued checkpoint with one UPDATE per CHECKPOINT_UPDATE_SIZE
+    events and returns the number of events they were run against. A
+    checkpoint is skipped if the event's start or rule changed since it was
+    computed, or if another writer already stored a later checkpoint for it.
+    """
+    pending = getattr(_pending_checkpoints, 'events', None)
+    if not pending:
+        return 0
+    _pending_checkpoints.events = {}
+    count = 0
+    for chunk in _chunks(list(pending.items()), CHECKPOINT_UPDATE_SIZE):
+        conditions = []
+        for pk, checkpoint in chunk:
+            conditions.append((Q(
+                Q(pk=pk,
+                  start=checkpoint['checkpoint_event_start'],
+                  rule_id=checkpoint['checkpoint_rule_id']),
+                Q(checkpoint_start__isnull=True) |
+                Q(checkpoint_start__lt=checkpoint['checkpoint_start']) |
+                ~Q(checkpoint_event_start=checkpoint['checkpoint_event_start']) |
+                ~Q(checkpoint_rule_id=checkpoint['checkpoint_rule_id'])), checkpoint))
+        updates = {}
+        for field in CHECKPOINT_FIELDS:
+            output_field = Event._meta.get_field(field)
+            updates[field] = Case(
+                *[When(condition, then=Value(checkpoint[field], output_field=output_field))
+                  for condition, checkpoint in conditions],
+                default=F(field),
+                output_field=output_field)
+        # update() skips post_save, checkpoints must not invalidate anything
+        count += Event.objects.filter(pk__in=[pk for pk, checkpoint in chunk]).update(**updates)
+    return count
+
+
 class EventManager(models.Manager):
     def get_for_object(self, content_object, distinction=None, inherit=True):
         return EventRelation.objects.get_events_for_object(content_object, distinction, inherit)
 
+    def in_window(self, start, end=None):
+        """
+        Returns the events that can have occurrences from start to end, or
+        after start if end is None: the ones starting before end whose first
+        occurrence ends after start or whose recurrence runs until start. The
+        filter only compares columns with constants so that it can use the
+        (calendar, start) and (calendar, end_recurring_period) indexes. It
+        leaves out the events whose last occurrence starts before start and is
+        still running then.
+        """
+        events = self.filter(
+            Q(end__gte=start) |
+            Q(rule__isnull=False, end_recurring_period__isnull=True) |
+            Q(rule__isnull=False, end_recurring_period__gte=start))
+        if end is not None:
+            events = events.filter(start__lte=end)
+        return events
+
+    def for_calendars(self, calendars):
+        """
+        Returns the events of all ``calendars`` as a single query, with their
+        calendar and rule, so overlaying many calendars costs as much as one
+        calendar with as many events.
+        """
+        return self.filter(calendar__in=calendars).select_related('calendar', 'rule')
+
+    def get_occurrences_for(self, events, start, end, engine=None, persisted_occurrences=None):
+        """
+        Returns the sorted occurrences of all ``events`` from start to end.
+        The persisted occurrences of every event are loaded with a single
+        query, or taken from ``persisted_occurrences`` if given, see
+        schedule.expansion.expand_occurrences.
+        """
+        from schedule.expansion import expand_occurrences
+        return sorted(expand_occurrences(events, start, end, engine, persisted_occurrences))
+
 
 class Event(models.Model):
     '''
@@ -45,12 +278,26 @@ class Event(models.Model):
     calendar = models.ForeignKey(Calendar, null=True, blank=True, verbose_name=_("calendar"))
     objects = EventManager()
 
-    recent_start = models.TextField(null=True, blank=True)
+    # Checkpoint of a recent occurrence, used by get_optimized_rrule_object as
+    # a later dtstart. It only holds while the event keeps the start and rule
+    # it was computed from.
+    checkpoint_start = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+    checkpoint_end = models.DateTimeField(null=True, blank=True, editable=False)
+    checkpoint_event_start = models.DateTimeField(null=True, blank=True, editable=False)
+    checkpoint_rule_id = models.IntegerField(null=True, blank=True, editable=False)
+
+    # The range materialized in OccurrenceIndex for this event, if any.
+    indexed_from = models.DateTimeField(null=True, blank=True, editable=False)
+    indexed_until = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         verbose_name = _('event')
         verbose_name_plural = _('events')
         app_label = 'schedule'
+        index_together = (
+            ('calendar', 'start'),
+            ('calendar', 'end_recurring_period'),
+        )
 
     def __unicode__(self):
         date_format = u'%s' % ugettext("DATE_FORMAT")
@@ -63,62 +310,50 @@ class Event(models.Model):
     def get_absolute_url(self):
         return reverse('event', args=[self.id])
 
-    def get_recent_start_validated(self):
+    def has_valid_checkpoint(self):
         """
-         Unserializes and validates self.recent_start. Returns the dictionary
-         represented by self.recent_start if all goes well, or None if there
-         is a validation error.
-         @return recent_start converted to object if it's valid given current
-         state of event; None if it doesn't exist or is invalid.
+        Returns True if the stored checkpoint was computed for the current
+        start and rule of this event.
         """
-        if self.recent_start == None:
-            return None
-
-        recent_start_data = pickle.loads(str(self.recent_start))
-
-        if (recent_start_data['event']['start'] == self.start and
-              recent_start_data['event']['rule_id'] == self.rule.pk):
-            return recent_start_data
-        else:
-            return None
-
+        return (self.checkpoint_start is not None and
+                self.rule_id is not None and
+                self.checkpoint_event_start == self.start and
+                self.checkpoint_rule_id == self.rule_id)
 
     @property
     def recent_occurrence_start(self):
         """
-        A lazy loaded property that ensures we unpickle to get the recent
-        occurrence start only once. Use similar pattern for other properties
-        :return:
-        """
-        if not hasattr(self, '_recent_start'):
-            setattr(self, '_recent_start', self.get_recent_start_validated())
-        recent_start = getattr(self, '_recent_start', None)
-        if (recent_start is not None
-            and 'occurrence' in recent_start
-            and 'start' in recent_start['occurrence']):
-            return recent_start['occurrence']['start']
-        else:
-            return None
-
+        The start of the checkpointed occurrence, or None if there is no
+        valid checkpoint for the current state of the event.
+        """
+        if self.has_valid_checkpoint():
+            return self.checkpoint_start
+        return None
 
-    def build_recent_start_payload(self, occurrence):
+    def set_checkpoint(self, occurrence):
         """
-        Builds a payload to store in self.recent_start and returns the result
-        @return string representation of payload representing recent start.
+        Records ``occurrence`` as the checkpoint of this event. The caller is
+        responsible for saving it.
         """
-        event_occurrence_data = {
-            'event': {
-                'start': self.start,
-                'rule_id': self.rule.pk
-            },
-            'occurrence': {
-                'start': occurrence.start,
-                'end': occurrence.end
-            }
-        }
-        event_occurrence_payload = pickle.dumps(event_occurrence_data)
-        return event_occurrence_payload
+        self.checkpoint_start = occurrence.start
+        self.checkpoint_end = occurrence.end
+        self.checkpoint_event_start = self.start
+        self.checkpoint_rule_id = self.rule_id
 
+    def _advance_checkpoint(self, occurrence):
+        """
+        Moves the checkpoint of this event up to ``occurrence`` if it lies far
+        enough past the current dtstart, and queues it to be saved.
+        """
+        # a count is relative to the original dtstart, it can't be moved
+        if self.pk is None or 'count' in self.rule.get_params():
+            return
+        dtstart = self.recent_occurrence_start or self.start
+        distance = datetime.timedelta(days=settings.RRULE_CHECKPOINT_DISTANCE)
+        if occurrence.start - dtstart < distance:
+            return
+        self.set_checkpoint(occurrence)
+        queue_checkpoint(self)
 
     def get_optimized_rrule_object(self, period_start):
         """
@@ -128,15 +363,12 @@ class Event(models.Model):
         period_start
         """
         if self.rule is not None:
-            params = self.rule.get_params()
-            frequency = self.rule.rrule_frequency()
-
             if self.recent_occurrence_start is not None and self.recent_occurrence_start < period_start:
                 # Optimization: use recent_occurrence_start for the rrule object
                 # to calculate occurrences.
-                return rrule.rrule(frequency, dtstart=self.recent_occurrence_start,  **params)
+                return get_rrule(self.rule, self.recent_occurrence_start, self._get_rrule_until())
             else:
-                return rrule.rrule(frequency, dtstart=self.start,  **params)
+                return get_rrule(self.rule, self.start, self._get_rrule_until())
 
 
 
@@ -146,7 +378,13 @@ class Event(models.Model):
         post_constraints), we need to ensure that we get the latest set of
         persisted_occurrences and avoid using the prefetch cache which may be
         stale. Client code can pass its own persisted_occurrences using the
-        `all().all()` pattern in these cases.
+        `all().all()` pattern in these cases. By default only the persisted
+        occurrences that intersect the window are loaded, see
+        OccurrenceManager.in_window.
+
+        :param skip_booster - Unused, kept for backwards compatibility. To
+        expand many events, use Event.objects.get_occurrences_for, which loads
+        their persisted occurrences with a single query.
 
         >>> rule = Rule(frequency = "MONTHLY", name = "Monthly")
         >>> rule.save()
@@ -165,45 +403,55 @@ class Event(models.Model):
         []
         """
 
-        if self.pk and not skip_booster:
-            # performance booster for occurrences relationship
-            Event.objects.prefetch_related('occurrence_set').get(pk=self.pk)
-
         if persisted_occurrences is None:
-            persisted_occurrences = self.occurrence_set.all()
+            persisted_occurrences = self.occurrence_set.in_window(start, end)
 
         occ_replacer = OccurrenceReplacer(persisted_occurrences)
-        occurrences = self._get_occurrence_list(start, end)
-        final_occurrences = []
-        for occ in occurrences:
-            # replace occurrences with their persisted counterparts
-            if occ_replacer.has_occurrence(occ):
-                p_occ = occ_replacer.get_occurrence(occ)
-                # ...but only if they are within this period
-                if p_occ.start <= end and p_occ.end >= start:
-                    final_occurrences.append(p_occ)
-            else:
-                final_occurrences.append(occ)
-        # then add persisted occurrences which originated outside of this period but now
-        # fall within it
-        final_occurrences += occ_replacer.get_additional_occurrences(start, end)
-        return final_occurrences
+        with batch_checkpoints():
+            return occ_replacer.merge(self._get_occurrence_list(start, end), start, end)
+
+    def get_conflicts(self, start, end, events=None):
+        """
+        Returns the (occurrence, other occurrence) pairs of the occurrences of
+        this event from start to end that overlap the occurrences of
+        ``events``, which default to the other events of its calendar. See
+        schedule.utils.find_overlaps. The event does not have to be saved, so
+        it can be checked before it is.
+        """
+        if events is None:
+            events = Event.objects.filter(calendar=self.calendar_id).exclude(pk=self.pk)
+        persisted_occurrences = [] if self.pk is None else None
+        return find_overlaps(self.get_occurrences(start, end, persisted_occurrences=persisted_occurrences),
+                             Event.objects.get_occurrences_for(events, start, end))
 
     def get_rrule_object(self):
         if self.rule is not None:
-            params = self.rule.get_params()
-            frequency = self.rule.rrule_frequency()
-            return rrule.rrule(frequency, dtstart=self.start,  **params)
+            return get_rrule(self.rule, self.start, self._get_rrule_until())
+
+    def get_fixed_series(self):
+        """
+        Returns a FixedSeries standing in for the rrule of this event if its
+        rule allows it, see get_fixed_series.
+        """
+        if self.rule is not None:
+            return get_fixed_series(self.rule, self.start, self._get_rrule_until())
+
+    def _get_rrule_until(self):
+        # dateutil refuses to mix naive and aware dtstart/until
+        until = self.end_recurring_period
+        if until is not None and timezone.is_aware(until) == timezone.is_aware(self.start):
+            return until
+        return None
 
     def _create_occurrence(self, start, end=None):
         if end is None:
             end = start + (self.end - self.start)
-        return Occurrence(event=self, start=start, end=end, original_start=start, original_end=end, title=self.title, description=self.description)
+        return TransientOccurrence(self, start, end)
 
     def get_occurrence(self, date):
         if timezone.is_naive(date) and django_settings.USE_TZ:
             date = timezone.make_aware(date, timezone.utc)
-        rule = self.get_rrule_object()
+        rule = self.get_fixed_series() or self.get_rrule_object()
         if rule:
             next_occurrence = rule.after(date, inc=True)
         else:
@@ -212,7 +460,8 @@ class Event(models.Model):
             try:
                 return Occurrence.objects.get(event=self, original_start=date)
             except Occurrence.DoesNotExist:
-                return self._create_occurrence(next_occurrence)
+                # callers edit the occurrence they asked for, give them a model
+                return self._create_occurrence(next_occurrence).promote()
 
 
     def _get_occurrence_list(self, start, end):
@@ -225,10 +474,11 @@ class Event(models.Model):
             if self.end_recurring_period and self.end_recurring_period < end:
                 end = self.end_recurring_period
 
-            rule = None
-            if get_boolean('ENABLE_OPTIMIZED_RRULE_GENERATION', False):
+            rule = self.get_fixed_series()
+            optimized = rule is None and get_boolean('ENABLE_OPTIMIZED_RRULE_GENERATION', False)
+            if optimized:
                 rule = self.get_optimized_rrule_object(start-difference)
-            else:
+            elif rule is None:
                 rule = self.get_rrule_object()
 
             o_starts = rule.between(start-difference, end, inc=True)
@@ -237,6 +487,9 @@ class Event(models.Model):
                 o_end = o_start + difference
                 occurrences.append(self._create_occurrence(o_start, o_end))
 
+            if optimized and occurrences:
+                self._advance_checkpoint(occurrences[0])
+
             return occurrences
         else:
             # check if event is in the period
@@ -245,6 +498,65 @@ class Event(models.Model):
             else:
                 return []
 
+    def _iter_occurrence_list(self, start, end):
+        """
+        Lazy counterpart of _get_occurrence_list, yielding the occurrences of
+        this event from start to end in start order. Rules seek to the
+        window like in _seek_occurrences, and only the current date is kept.
+        """
+        if self.rule is None:
+            if self.start <= end and self.end >= start:
+                yield self._create_occurrence(self.start)
+            return
+        for occurrence in self._seek_occurrences(start - (self.end - self.start)):
+            if occurrence.start > end:
+                return
+            yield occurrence
+
+    def _seek_occurrences(self, start):
+        """
+        Yields the generated occurrences of this event starting at or after
+        ``start`` in start order. Fixed step rules seek straight to start, and
+        other rules iterate from their checkpoint when it comes before start,
+        see get_optimized_rrule_object.
+        """
+        difference = self.end - self.start
+        if self.rule is None:
+            if self.start >= start:
+                yield self._create_occurrence(self.start)
+            return
+        series = self.get_fixed_series()
+        if series is not None:
+            o_starts = series.xafter(start, inc=True)
+        else:
+            rule = self.get_optimized_rrule_object(start)
+            # xafter is missing from older dateutil releases
+            if hasattr(rule, 'xafter'):
+                o_starts = rule.xafter(start, inc=True)
+            else:
+                o_starts = (o_start for o_start in rule if o_start >= start)
+        for o_start in o_starts:
+            if self.end_recurring_period and o_start > self.end_recurring_period:
+                return
+            yield self._create_occurrence(o_start, o_start + difference)
+
+    def _has_occurrence_at(self, o_start, o_end, start, end):
+        """
+        Returns whether _get_occurrence_list(start, end) includes an
+        occurrence from o_start to o_end, without expanding the whole window.
+        """
+        difference = self.end - self.start
+        if o_end - o_start != difference:
+            return False
+        if self.rule is None:
+            return o_start == self.start and self.start <= end and self.end >= start
+        if self.end_recurring_period and self.end_recurring_period < end:
+            end = self.end_recurring_period
+        if not start - difference <= o_start <= end:
+            return False
+        rule = self.get_fixed_series() or self.get_rrule_object()
+        return rule.after(o_start, inc=True) == o_start
+
     def _occurrences_after_generator(self, after=None, tzinfo=pytz.utc):
         """
         returns a generator that produces unpresisted occurrences after the
@@ -258,8 +570,13 @@ class Event(models.Model):
             if self.end > after:
                 yield self._create_occurrence(self.start, self.end)
             raise StopIteration
-        date_iter = iter(rule)
         difference = self.end - self.start
+        series = self.get_fixed_series()
+        if series is not None:
+            # skip the occurrences ending before after
+            date_iter = series.xafter(after - difference)
+        else:
+            date_iter = iter(rule)
         while True:
             o_start = next(date_iter)
             if o_start > self.end_recurring_period:
@@ -273,7 +590,9 @@ class Event(models.Model):
         returns a generator that produces occurrences after the datetime
         ``after``.  Includes all of the persisted Occurrences.
         """
-        occ_replacer = OccurrenceReplacer(self.occurrence_set.all())
+        if after is None:
+            after = timezone.now()
+        occ_replacer = OccurrenceReplacer(self.occurrence_set.in_window(after))
         generator = self._occurrences_after_generator(after)
         while True:
             next_occ = next(generator)
@@ -423,6 +742,7 @@ class EventRelation(models.Model):
     object_id = models.IntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
     distinction = models.CharField(_("distinction"), max_length=20, null=True)
+    updated_on = models.DateTimeField(_("updated on"), auto_now=True, null=True)
 
     objects = EventRelationManager()
 
@@ -435,40 +755,131 @@ class EventRelation(models.Model):
         return u'%s(%s)-%s' % (self.event.title, self.distinction, self.content_object)
 
 
-class Occurrence(models.Model):
-    event = models.ForeignKey(Event, verbose_name=_("event"))
-    title = models.CharField(_("title"), max_length=255, blank=True, null=True)
-    description = models.TextField(_("description"), blank=True, null=True)
-    start = models.DateTimeField(_("start"))
-    end = models.DateTimeField(_("end"))
-    cancelled = models.BooleanField(_("cancelled"), default=False)
-    original_start = models.DateTimeField(_("original start"))
-    original_end = models.DateTimeField(_("original end"))
-    created_on = models.DateTimeField(_("created on"), auto_now_add=True)
-    updated_on = models.DateTimeField(_("updated on"), auto_now=True)
+# Occurrences read or written by each query of OccurrenceManager.apply_changes.
+# The UPDATE binds 7 parameters per occurrence, which keeps it under the 999
+# that SQLite allows by default before 3.32.
+APPLY_CHANGES_BATCH_SIZE = 100
 
-    class Meta:
-        verbose_name = _("occurrence")
-        verbose_name_plural = _("occurrences")
-        app_label = 'schedule'
+
+class OccurrenceManager(models.Manager):
+
+    def in_window(self, start, end=None):
+        """
+        Returns the occurrences whose original or current span intersects the
+        window from start to end, or that end after start if end is None.
+        These are the only persisted occurrences that can replace or add to
+        the occurrences generated for that window.
+        """
+        current = Q(end__gte=start)
+        original = Q(original_end__gte=start)
+        if end is not None:
+            current &= Q(start__lte=end)
+            original &= Q(original_start__lte=end)
+        return self.filter(current | original)
+
+    def apply_changes(self, changes):
+        """
+        Applies ``changes``, a list of (event, original start, action, start,
+        end) tuples where action is 'cancel', 'uncancel' or 'move' and start
+        and end are the new dates of a moved occurrence, and returns the
+        changed occurrences. Raises ValueError, before anything is written,
+        if an event has no occurrence at an original start.
+
+        Every APPLY_CHANGES_BATCH_SIZE changes, the persisted occurrences
+        involved are loaded with one query, the missing ones are read back
+        with one query for their primary keys after a single bulk_create, and
+        the others are updated with one UPDATE. Since no signal is sent, the events are marked as stale
+        in the OccurrenceIndex with one more UPDATE and the versions of their
+        calendars are bumped here, once per calendar.
+        """
+        from schedule.models.occurrence_index import OccurrenceIndex
+        from schedule.utils import bump_calendar_version
+
+        events = {}
+        for event, original_start, action, start, end in changes:
+            original_end = original_start + (event.end - event.start)
+            if not event._has_occurrence_at(original_start, original_end, original_start, original_start):
+                raise ValueError("%r has no occurrence at %s" % (event, original_start))
+            if action not in ('cancel', 'uncancel', 'move'):
+                raise ValueError("Unknown occurrence action %r" % (action,))
+            events[event.pk] = event
+        if not events:
+            return []
+
+        persisted = {}
+        for chunk in _chunks(changes, APPLY_CHANGES_BATCH_SIZE):
+            for occurrence in self.filter(event__in=set(change[0].pk for change in chunk),
+                                          original_start__in=set(change[1] for change in chunk)):
+                persisted[(occurrence.event_id, occurrence.original_start)] = occurrence
+        created = {}
+        changed = OrderedDict()
+        for event, original_start, action, start, end in changes:
+            key = (event.pk, original_start)
+            occurrence = persisted.get(key) or created.get(key)
+            if occurrence is None:
+                occurrence = created[key] = event._create_occurrence(original_start).promote()
+            occurrence.event = events[event.pk]
+            if action == 'move':
+                occurrence.start, occurrence.end = start, end
+            else:
+                occurrence.cancelled = action == 'cancel'
+            changed[key] = occurrence
+
+        updated = [occurrence for key, occurrence in changed.items() if key not in created]
+        with transaction.atomic():
+            self.bulk_create(created.values())
+            # bulk_create only sets primary keys on PostgreSQL
+            keys = set((occurrence.event_id, occurrence.original_start, occurrence.original_end)
+                       for occurrence in created.values())
+            for chunk in _chunks(list(created), APPLY_CHANGES_BATCH_SIZE):
+                for occurrence in self.filter(event__in=set(key[0] for key in chunk),
+                                              original_start__in=set(key[1] for key in chunk)):
+                    key = (occurrence.event_id, occurrence.original_start)
+                    if key in created and (key + (occurrence.original_end,)) in keys:
+                        occurrence.event = events[occurrence.event_id]
+                        changed[key] = occurrence
+            now = timezone.now()
+            for chunk in _chunks(updated, APPLY_CHANGES_BATCH_SIZE):
+                updates = {'updated_on': Value(now, output_field=self.model._meta.get_field('updated_on'))}
+                for field in ('start', 'end', 'cancelled'):
+                    output_field = self.model._meta.get_field(field)
+                    updates[field] = Case(
+                        *[When(pk=occurrence.pk, then=Value(getattr(occurrence, field), output_field=output_field))
+                          for occurrence in chunk],
+                        default=F(field),
+                        output_field=output_field)
+                self.filter(pk__in=[occurrence.pk for occurrence in chunk]).update(**updates)
+            for occurrence in updated:
+                occurrence.updated_on = now
+
+        if settings.USE_OCCURRENCE_INDEX:
+            OccurrenceIndex.objects.invalidate_events(events)
+            for event in events.values():
+                event.indexed_from = event.indexed_until = None
+        for calendar_id in set(event.calendar_id for event in events.values()):
+            bump_calendar_version(calendar_id)
+        return list(changed.values())
+
+
+class OccurrenceMixin(object):
+    """
+    The read API shared by persisted Occurrences and the TransientOccurrences
+    generated from an event's rule.
+    """
+    __slots__ = ()
 
     def moved(self):
         return self.original_start != self.start or self.original_end != self.end
 
     moved = property(moved)
 
-    def move(self, new_start, new_end):
-        self.start = new_start
-        self.end = new_end
-        self.save()
-
-    def cancel(self):
-        self.cancelled = True
-        self.save()
-
-    def uncancel(self):
-        self.cancelled = False
-        self.save()
+    @property
+    def calendar(self):
+        """
+        The calendar of the occurrence's event, which tells apart the
+        occurrences of overlaid calendars (see EventManager.for_calendars).
+        """
+        return self.event.calendar
 
     def get_absolute_url(self):
         if self.pk is not None:
@@ -525,9 +936,154 @@ class Occurrence(models.Model):
         return rank
 
     def __lt__(self, other):
-        return (isinstance(other, Occurrence) and
+        return (isinstance(other, OccurrenceMixin) and
                 self.original_start < other.original_start and self.original_end < other.original_end)
 
     def __eq__(self, other):
-        return (isinstance(other, Occurrence) and
+        return (isinstance(other, OccurrenceMixin) and
                 self.original_start == other.original_start and self.original_end == other.original_end)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class Occurrence(OccurrenceMixin, models.Model):
+    event = models.ForeignKey(Event, verbose_name=_("event"))
+    title = models.CharField(_("title"), max_length=255, blank=True, null=True)
+    description = models.TextField(_("description"), blank=True, null=True)
+    start = models.DateTimeField(_("start"))
+    end = models.DateTimeField(_("end"))
+    cancelled = models.BooleanField(_("cancelled"), default=False)
+    original_start = models.DateTimeField(_("original start"))
+    original_end = models.DateTimeField(_("original end"))
+    created_on = models.DateTimeField(_("created on"), auto_now_add=True)
+    updated_on = models.DateTimeField(_("updated on"), auto_now=True)
+    objects = OccurrenceManager()
+
+    class Meta:
+        verbose_name = _("occurrence")
+        verbose_name_plural = _("occurrences")
+        app_label = 'schedule'
+        index_together = (
+            ('event', 'start', 'end'),
+            ('event', 'original_start', 'original_end'),
+        )
+
+    def move(self, new_start, new_end):
+        self.start = new_start
+        self.end = new_end
+        self.save()
+
+    def cancel(self):
+        self.cancelled = True
+        self.save()
+
+    def uncancel(self):
+        self.cancelled = False
+        self.save()
+
+
+class TransientOccurrence(OccurrenceMixin):
+    """
+    An occurrence generated from an event's rule that has not been saved.
+
+    It has the API of Occurrence (title and description come from the
+    event) at a fraction of the cost of a model instance. Setting title,
+    description or cancelled, save(), move(), cancel() and uncancel() promote
+    it to an Occurrence, which then backs this object. save() also copies
+    start and end to it.
+    """
+    __slots__ = ('event', 'start', 'end', 'original_start', 'original_end', 'persisted')
+
+    def __init__(self, event, start, end):
+        self.event = event
+        self.start = self.original_start = start
+        self.end = self.original_end = end
+        self.persisted = None
+
+    @property
+    def pk(self):
+        if self.persisted is not None:
+            return self.persisted.pk
+        return None
+    id = pk
+
+    @property
+    def event_id(self):
+        return self.event.pk
+
+    @property
+    def title(self):
+        if self.persisted is not None:
+            return self.persisted.title
+        return self.event.title
+
+    @title.setter
+    def title(self, value):
+        self.promote().title = value
+
+    @property
+    def description(self):
+        if self.persisted is not None:
+            return self.persisted.description
+        return self.event.description
+
+    @description.setter
+    def description(self, value):
+        self.promote().description = value
+
+    @property
+    def cancelled(self):
+        return self.persisted is not None and self.persisted.cancelled
+
+    @cancelled.setter
+    def cancelled(self, value):
+        self.promote().cancelled = value
+
+    def __hash__(self):
+        return hash((self.event_id, self.original_start, self.original_end))
+
+    def __str__(self):
+        return force_str(self.__unicode__())
+
+    def __repr__(self):
+        return force_str(u'<%s: %s>' % (self.__class__.__name__, self.__unicode__()))
+
+    def promote(self):
+        """
+        Returns the Occurrence backing this occurrence, creating it unsaved
+        if needed.
+        """
+        if self.persisted is None:
+            self.persisted = Occurrence(
+                event=self.event,
+                start=self.start,
+                end=self.end,
+                original_start=self.original_start,
+                original_end=self.original_end,
+                title=self.event.title,
+                description=self.event.description,
+            )
+        return self.persisted
+
+    def save(self):
+        persisted = self.promote()
+        persisted.start = self.start
+        persisted.end = self.end
+        persisted.save()
+
+    def move(self, new_start, new_end):
+        self.promote().move(new_start, new_end)
+        self.start = new_start
+        self.end = new_end
+
+    def cancel(self):
+        self.promote().cancel()
+
+    def uncancel(self):
+        self.promote().uncancel()
+
+    def delete(self):
+        if self.persisted is not None and self.persisted.pk is not None:
+            self.persisted.delete()
+        self.persisted = None
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import datetime
+
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+from schedule.conf import settings
+from schedule.models.calendars import Calendar
+from schedule.models.events import Event, Occurrence
+
+
+class OccurrenceIndexManager(models.Manager):
+
+    def get_horizon(self, now=None):
+        """
+        Returns the (start, end) range that is materialized for every event.
+        """
+        if now is None:
+            now = timezone.now()
+        horizon = datetime.timedelta(days=settings.OCCURRENCE_INDEX_HORIZON)
+        return now - horizon, now + horizon
+
+    def rebuild_for_event(self, event, now=None):
+        """
+        Replaces the indexed rows of ``event`` with the occurrences, persisted
+        ones included, that fall within the current horizon.
+        """
+        self.filter(event=event).delete()
+        start, end = self.get_horizon(now)
+        rows = [OccurrenceIndex(
+            calendar_id=event.calendar_id,
+            event=event,
+            occurrence=occurrence if occurrence.pk else None,
+            start=occurrence.start,
+            end=occurrence.end,
+            original_start=occurrence.original_start,
+            cancelled=occurrence.cancelled,
+        ) for occurrence in event.get_occurrences(
+            start, end, persisted_occurrences=Occurrence.objects.filter(event=event))]
+        self.bulk_create(rows)
+        # update() keeps the post_save handlers from rebuilding again
+        Event.objects.filter(pk=event.pk).update(indexed_from=start, indexed_until=end)
+        event.indexed_from = start
+        event.indexed_until = end
+
+    def rebuild_for_rule(self, rule, now=None):
+        for event in rule.event_set.all():
+            self.rebuild_for_event(event, now)
+
+    def update_for_occurrence(self, occurrence):
+        """
+        Replaces the indexed row of the slot of the persisted ``occurrence``,
+        leaving the other rows of its event alone. Nothing is done if the
+        event is not indexed.
+        """
+        event = occurrence.event
+        # the event instance may predate its last rebuild
+        start, end = Event.objects.filter(pk=event.pk).values_list('indexed_from', 'indexed_until').get()
+        if start is None:
+            return
+        self.filter(Q(original_start=occurrence.original_start) | Q(occurrence=occurrence), event=event).delete()
+        # same rules as OccurrenceReplacer.merge over the indexed range
+        if event._has_occurrence_at(occurrence.original_start, occurrence.original_end, start, end):
+            shown = occurrence.start <= end and occurrence.end >= start
+        else:
+            shown = occurrence.start < end and occurrence.end >= start and not occurrence.cancelled
+        if shown:
+            self.create(
+                calendar_id=event.calendar_id,
+                event=event,
+                occurrence=occurrence,
+                start=occurrence.start,
+                end=occurrence.end,
+                original_start=occurrence.original_start,
+                cancelled=occurrence.cancelled,
+            )
+
+    def invalidate_events(self, event_ids):
+        """
+        Marks the indexed rows of the events of ``event_ids`` as unusable
+        until the update_occurrence_index command rebuilds them, with a single
+        UPDATE however many occurrences the events have.
+        """
+        Event.objects.filter(pk__in=list(event_ids)).update(indexed_from=None, indexed_until=None)
+
+    def invalidate_rule(self, rule):
+        """
+        Marks the indexed rows of every event of ``rule`` as unusable until
+        the update_occurrence_index command rebuilds them, so that saving a
+        rule shared by many events costs a single UPDATE.
+        """
+        Event.objects.filter(rule=rule).update(indexed_from=None, indexed_until=None)
+
+    def get_occurrences(self, events, start, end):
+        """
+        Returns the occurrences of ``events`` between start and end with one
+        range query, or None if any of the events is not indexed for the whole
+        window and the occurrences have to be expanded from their rules.
+        """
+        events = dict((event.pk, event) for event in events)
+        for event in events.values():
+            if (event.pk is None or event.indexed_from is None or
+                    event.indexed_from > start or event.indexed_until < end):
+                return None
+        rows = self.filter(
+            event__in=list(events),
+            start__lte=end,
+            end__gte=start,
+        ).select_related('occurrence')
+        occurrences = []
+        for row in rows:
+            event = events[row.event_id]
+            if row.occurrence is not None:
+                occurrence = row.occurrence
+                occurrence.event = event
+                # rows are shown for the whole horizon, while expanding the
+                # window leaves out cancelled occurrences moved into it
+                if occurrence.cancelled and not event._has_occurrence_at(
+                        occurrence.original_start, occurrence.original_end, start, end):
+                    continue
+            else:
+                occurrence = event._create_occurrence(row.start, row.end)
+            occurrences.append(occurrence)
+        return occurrences
+
+
+class OccurrenceIndex(models.Model):
+    '''
+    A materialized row for every occurrence of an event within a rolling
+    horizon (see OCCURRENCE_INDEX_HORIZON), so windows inside the horizon can
+    be answered without expanding any rrule.  The row of a persisted
+    occurrence is replaced when it is saved. Saving an event or a rule only
+    marks the events as stale until the update_occurrence_index command
+    rebuilds them.
+
+    occurrence is set when the row comes from a persisted Occurrence.
+    '''
+    calendar = models.ForeignKey(Calendar, null=True, blank=True, verbose_name=_("calendar"))
+    event = models.ForeignKey(Event, verbose_name=_("event"))
+    occurrence = models.ForeignKey(Occurrence, null=True, blank=True, verbose_name=_("occurrence"))
+    start = models.DateTimeField(_("start"))
+    end = models.DateTimeField(_("end"))
+    original_start = models.DateTimeField(_("original start"))
+    cancelled = models.BooleanField(_("cancelled"), default=False)
+
+    objects = OccurrenceIndexManager()
+
+    class Meta:
+        verbose_name = _("occurrence index")
+        verbose_name_plural = _("occurrence index")
+        app_label = 'schedule'
+        index_together = (
+            ('calendar', 'start', 'end'),
+            ('event', 'start', 'end'),
+        )
+
+    def __unicode__(self):
+        return u'%s: %s - %s' % (self.event_id, self.start, self.end)
@@ -1,9 +1,19 @@
 from __future__ import absolute_import
-from dateutil.rrule import DAILY, MONTHLY, WEEKLY, YEARLY, HOURLY, MINUTELY, SECONDLY
+import json
+import logging
+import re
+import pytz
+from dateutil.rrule import DAILY, MONTHLY, WEEKLY, YEARLY, HOURLY, MINUTELY, SECONDLY, weekday
 
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.translation import ugettext_lazy as _
 
+from schedule.conf import settings
+from schedule.utils import LRUCache, get_timezone
+
+logger = logging.getLogger(__name__)
+
 freqs = (("YEARLY", _("Yearly")),
          ("MONTHLY", _("Monthly")),
          ("WEEKLY", _("Weekly")),
@@ -12,6 +22,96 @@ freqs = (("YEARLY", _("Yearly")),
          ("MINUTELY", _("Minutely")),
          ("SECONDLY", _("Secondly")))
 
+INT_PARAMS = ('count', 'interval', 'bysetpos', 'bymonth', 'bymonthday', 'byyearday',
+              'byweekno', 'byhour', 'byminute', 'bysecond', 'byeaster')
+WEEKDAY_PARAMS = ('byweekday', 'wkst')
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+WEEKDAY_RE = re.compile(r'^(?:([+-]?\d+)?(MO|TU|WE|TH|FR|SA|SU)|(MO|TU|WE|TH|FR|SA|SU)\(([+-]?\d+)\))$')
+
+# Resolved rrule kwargs of saved rules, keyed on (rule pk, params).
+rule_registry = LRUCache(settings.RRULE_CACHE_SIZE)
+
+
+def _parse_weekday(value):
+  try:
+    return int(value)
+  except ValueError:
+    pass
+  match = WEEKDAY_RE.match(value.upper())
+  if match is None:
+    raise ValueError(value)
+  n, day, day_, n_ = match.groups()
+  n = n or n_
+  return [WEEKDAYS.index(day or day_), int(n) if n else None]
+
+
+def _parse_param(name, values):
+  try:
+    if name in INT_PARAMS:
+      values = [int(value) for value in values]
+    elif name in WEEKDAY_PARAMS:
+      values = [_parse_weekday(value.strip()) for value in values]
+    elif name == 'tzid':
+      values = [value.strip() for value in values]
+      if len(values) != 1:
+        raise ValueError(values)
+      get_timezone(values[0])
+    else:
+      raise ValidationError(_("Unknown rule param %(name)s.") % {'name': name})
+  except (ValueError, pytz.UnknownTimeZoneError):
+    raise ValidationError(_("Invalid value for rule param %(name)s.") % {'name': name})
+  if len(values) == 1 and name not in WEEKDAY_PARAMS:
+    values = values[0]
+  return values
+
+
+def parse_params(params, strict=True):
+  """
+  Validates a params string and returns its normalized, JSON serializable
+  form. Weekday params are always lists, with weekdays stored as [weekday, n]
+  pairs. Raises ValidationError if a param is unknown or has a malformed value,
+  or, if ``strict`` is False, logs it and leaves it out.
+
+  >>> parse_params("count:1;byweekday:MO,FR(-1)")
+  {'count': 1, 'byweekday': [[0, None], [4, -1]]}
+  """
+  param_dict = {}
+  if not params:
+    return param_dict
+  for param in params.split(';'):
+    param = param.split(':')
+    if len(param) != 2:
+      continue
+    name, values = str(param[0].strip()), param[1].split(',')
+    try:
+      param_dict[name] = _parse_param(name, values)
+    except ValidationError as e:
+      if strict:
+        raise
+      logger.warning("Ignoring rule param %s in %r: %s", name, params, e.messages[0])
+  return param_dict
+
+
+def resolve_params(param_dict):
+  """
+  Turns the normalized form returned by parse_params into rrule kwargs, with
+  tzid resolved to its tzinfo.
+
+  >>> resolve_params({'count': 1, 'byweekday': [[0, None], [4, -1]]})
+  {'count': 1, 'byweekday': [MO, FR(-1)]}
+  """
+  resolved = {}
+  for name, values in param_dict.items():
+    name = str(name)
+    if name in WEEKDAY_PARAMS:
+      values = [weekday(*value) if isinstance(value, list) else value for value in values]
+      if len(values) == 1:
+        values = values[0]
+    elif name == 'tzid':
+      values = get_timezone(values)
+    resolved[name] = values
+  return resolved
+
 
 class RuleManager(models.Manager):
 
@@ -53,7 +153,15 @@ class Rule(models.Model):
       ** byminute
       ** bysecond
       ** byeaster
+      ** interval
+      ** wkst
       ** tzid
+
+    byweekday and wkst also accept weekday names, eg. MO, FR(-1) or -1FR.
+  * parsed_params - the validated params, as stored by save(). Expansions
+    read their rrule kwargs from here instead of parsing params again.
+  * updated_on - when the rule was last saved, which the validators of
+    calendar views compare (see schedule.utils.get_calendar_validators).
   """
   objects = RuleManager()
 
@@ -61,6 +169,8 @@ class Rule(models.Model):
   description = models.TextField(_("description"))
   frequency = models.CharField(_("frequency"), choices=freqs, max_length=10)
   params = models.TextField(_("params"), null=True, blank=True)
+  parsed_params = models.TextField(null=True, blank=True, editable=False)
+  updated_on = models.DateTimeField(_("updated on"), auto_now=True, null=True)
 
   class Meta:
     verbose_name = _('rule')
@@ -79,27 +189,46 @@ class Rule(models.Model):
     }
     return compatibiliy_dict[self.frequency]
 
+  @classmethod
+  def from_db(cls, db, field_names, values):
+    instance = super(Rule, cls).from_db(db, field_names, values)
+    instance._saved_params = instance.params
+    return instance
+
+  def clean(self):
+    try:
+      parse_params(self.params)
+    except ValidationError as e:
+      raise ValidationError({'params': e.messages})
+
+  def save(self, *args, **kwargs):
+    self.parsed_params = json.dumps(parse_params(self.params))
+    super(Rule, self).save(*args, **kwargs)
+    self._saved_params = self.params
+
   def get_params(self):
     """
+    Returns the rrule kwargs of this rule. They are resolved once per rule
+    and params and then shared through ``rule_registry``; callers get a copy.
+    Params that were never validated, like those of rules saved before
+    parsed_params existed, are parsed leniently: invalid ones are logged and
+    ignored so that the rule can still be expanded.
+
     >>> rule = Rule(params = "count:1;bysecond:1;byminute:1,2,4,5")
     >>> rule.get_params()
     {'count': 1, 'byminute': [1, 2, 4, 5], 'bysecond': 1}
     """
     if self.params is None:
       return {}
-    params = self.params.split(';')
-    param_dict = []
-    for param in params:
-      param = param.split(':')
-      if len(param) == 2:
-        try:
-          param = (str(param[0]), [int(p) for p in param[1].split(',')])
-        except:
-          param = (str(param[0]), [str(p) for p in param[1].split(',')])
-        if len(param[1]) == 1:
-          param = (param[0], param[1][0])
-        param_dict.append(param)
-    return dict(param_dict)
+    key = (self.pk, self.params)
+    params = rule_registry.get(key)
+    if params is None:
+      if self.parsed_params is not None and getattr(self, '_saved_params', None) == self.params:
+        params = resolve_params(json.loads(self.parsed_params))
+      else:
+        params = resolve_params(parse_params(self.params, strict=False))
+      rule_registry.set(key, params)
+    return dict(params)
 
   def __unicode__(self):
     """Human readable string for Rule"""
@@ -1,14 +1,19 @@
 from __future__ import absolute_import
 import pytz
 import datetime
+import hashlib
 import calendar as standardlib_calendar
+from bisect import bisect_left, bisect_right
 
 from django.conf import settings
 from django.template.defaultfilters import date as date_filter
 from django.utils.translation import ugettext
 from django.utils.dates import WEEKDAYS, WEEKDAYS_ABBR
+from schedule.conf import settings as schedule_settings
 from schedule.conf.settings import FIRST_DAY_OF_WEEK, SHOW_CANCELLED_OCCURRENCES
-from schedule.models import Occurrence
+from schedule.expansion import iter_occurrences
+from schedule.models import Event, Occurrence, OccurrenceIndex
+from schedule.utils import LRUCache, get_period_cache, get_calendar_versions, iter_busy_ranges
 from django.utils import timezone
 from six.moves import range
 
@@ -28,13 +33,108 @@ else:
         weekday_abbrs.append(WEEKDAYS_ABBR[i])
 
 
+# UTC start of local days, keyed on (tzinfo, date). See get_day_boundaries.
+day_boundary_cache = LRUCache(10000)
+
+
+def get_day_boundaries(tzinfo, first, last):
+    """
+    Returns the utc start of every local day in ``tzinfo`` from date
+    ``first`` to ``last`` included. Boundaries are cached per process, so the
+    periods of a year view localize each day once.
+    """
+    boundaries = []
+    date = first
+    while date <= last:
+        key = (tzinfo, date)
+        boundary = day_boundary_cache.get(key)
+        if boundary is None:
+            naive_start = datetime.datetime.combine(date, datetime.time.min)
+            boundary = tzinfo.localize(naive_start).astimezone(pytz.utc)
+            day_boundary_cache.set(key, boundary)
+        boundaries.append(boundary)
+        date += datetime.timedelta(days=1)
+    return boundaries
+
+
+def get_day_boundary(tzinfo, date):
+    """
+    Returns the utc start of the local day ``date`` in ``tzinfo``.
+    """
+    return get_day_boundaries(tzinfo, date, date)[0]
+
+
+def classify_occurrence(occurrence, start, end):
+    """
+    Returns how ``occurrence`` relates to the period from start to end, or
+    None if it does not show up in it. The class is 0 if it only starts in
+    the period, 1 if it starts and ends in it, 2 if it spans the period and 3
+    if it only ends in it.
+    """
+    if occurrence.cancelled and not SHOW_CANCELLED_OCCURRENCES:
+        return
+    if occurrence.start > end or occurrence.end < start:
+        return None
+    started = False
+    ended = False
+    if start <= occurrence.start < end:
+        started = True
+    if start <= occurrence.end < end:
+        ended = True
+    if started and ended:
+        return {'occurrence': occurrence, 'class': 1}
+    elif started:
+        return {'occurrence': occurrence, 'class': 0}
+    elif ended:
+        return {'occurrence': occurrence, 'class': 3}
+    # it existed during this period but it didn't begin or end within it
+    # so it must have just continued
+    return {'occurrence': occurrence, 'class': 2}
+
+
+class OccurrencePool(object):
+    """
+    The occurrences of a period, handed down to its sub-periods. They are
+    indexed by start so that each sub-period bisects its own slice out of the
+    pool instead of scanning all of it. Occurrences starting before a window
+    can still overlap it, which is bounded by the longest occurrence.
+    """
+
+    def __init__(self, occurrences):
+        self.occurrences = list(occurrences)
+        self.index = sorted((occurrence.start, position) for position, occurrence in enumerate(self.occurrences))
+        self.starts = [start for start, position in self.index]
+        self.max_duration = max([occurrence.end - occurrence.start for occurrence in self.occurrences] or
+                                [datetime.timedelta(0)])
+
+    def __iter__(self):
+        return iter(self.occurrences)
+
+    def __len__(self):
+        return len(self.occurrences)
+
+    def get_occurrences(self, start, end):
+        """
+        Returns the occurrences that exist at all between start and end, in
+        pool order.
+        """
+        low = bisect_left(self.starts, start - self.max_duration)
+        high = bisect_right(self.starts, end)
+        positions = sorted(position for occurrence_start, position in self.index[low:high]
+                           if self.occurrences[position].end >= start)
+        return [self.occurrences[position] for position in positions]
+
+
 class Period(object):
     """
     This class represents a period of time. It can return a set of occurrences
     based on its events, and its time period (start and end).
+
+    ``engine`` selects how occurrences are expanded, see
+    OCCURRENCE_EXPANSION_ENGINE.
     """
     def __init__(self, events, start, end, parent_persisted_occurrences=None,
-                 occurrence_pool=None, tzinfo=pytz.utc):
+                 occurrence_pool=None, tzinfo=pytz.utc, engine=None):
 
         self.utc_start = self._normalize_timezone_to_utc(start, tzinfo)
 
@@ -42,10 +142,25 @@ class Period(object):
 
         self.events = events
         self.tzinfo = self._get_tzinfo(tzinfo)
+        if occurrence_pool is not None and not isinstance(occurrence_pool, OccurrencePool):
+            occurrence_pool = OccurrencePool(occurrence_pool)
         self.occurrence_pool = occurrence_pool
+        self.engine = engine
+        self.day_buckets = None
+        self.persisted_occurrences_given = parent_persisted_occurrences is not None
         if parent_persisted_occurrences is not None:
             self._persisted_occurrences = parent_persisted_occurrences
 
+    @classmethod
+    def for_calendars(cls, calendars, *args, **kwargs):
+        """
+        Returns a period of this class over the events of all ``calendars``,
+        which are loaded with a single query. The other arguments are those of
+        the class, without the events. Every occurrence of the period can be
+        told apart by its ``calendar``.
+        """
+        return cls(Event.objects.for_calendars(calendars), *args, **kwargs)
+
     def _normalize_timezone_to_utc(self, point_in_time, tzinfo):
         if point_in_time.tzinfo is not None:
             return point_in_time.astimezone(pytz.utc)
@@ -69,16 +184,75 @@ class Period(object):
         return tzinfo if settings.USE_TZ else None
 
     def _get_sorted_occurrences(self):
-        occurrences = []
         if hasattr(self, "occurrence_pool") and self.occurrence_pool is not None:
-            for occurrence in self.occurrence_pool:
-                if occurrence.start <= self.utc_end and occurrence.end >= self.utc_start:
-                    occurrences.append(occurrence)
-            return occurrences
-        for event in self.events:
-            event_occurrences = event.get_occurrences(self.start, self.end)
-            occurrences += event_occurrences
-        return sorted(occurrences)
+            return self.occurrence_pool.get_occurrences(self.utc_start, self.utc_end)
+        cache_key = self.get_cache_key()
+        if cache_key is not None:
+            rows = get_period_cache().get(cache_key)
+            if rows is not None:
+                return self._unpack_occurrences(rows)
+        occurrences = None
+        if schedule_settings.USE_OCCURRENCE_INDEX:
+            occurrences = OccurrenceIndex.objects.get_occurrences(self.events, self.start, self.end)
+            if occurrences is not None:
+                occurrences = sorted(occurrences)
+        if occurrences is None:
+            occurrences = Event.objects.get_occurrences_for(self.events, self.start, self.end, self.engine,
+                                                            self.get_persisted_occurrences())
+        if cache_key is not None:
+            get_period_cache().set(cache_key, self._pack_occurrences(occurrences),
+                                   schedule_settings.PERIOD_CACHE_TIMEOUT)
+        return occurrences
+
+    def get_cache_key(self):
+        """
+        Returns the key of the occurrences of this period in PERIOD_CACHE, or
+        None if they are not to be cached. The key covers the events, the
+        bounds and timezone of the period and the version of every calendar
+        involved, which is bumped whenever one of its events, rules or
+        occurrences changes, so stale entries are simply never read again.
+        Periods given their persisted occurrences are not cached, since those
+        may differ from the ones in the database.
+        """
+        if get_period_cache() is None or self.persisted_occurrences_given:
+            return None
+        events = list(self.events)
+        if any(event.pk is None for event in events):
+            return None
+        versions = get_calendar_versions(set(event.calendar_id for event in events))
+        key = repr((
+            sorted(versions.items()),
+            sorted(event.pk for event in events),
+            self.utc_start.isoformat(),
+            self.utc_end.isoformat(),
+            getattr(self.tzinfo, 'zone', None),
+        ))
+        return 'schedule:period:%s' % hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def _pack_occurrences(self, occurrences):
+        # Events are not stored with their occurrences: they are rebuilt from
+        # the events of the period, see _unpack_occurrences.
+        field_names = [field.attname for field in Occurrence._meta.concrete_fields]
+        rows = []
+        for occurrence in occurrences:
+            if occurrence.pk is not None:
+                rows.append((None, None, None, tuple(getattr(occurrence, name) for name in field_names)))
+            else:
+                rows.append((occurrence.event_id, occurrence.start, occurrence.end, None))
+        return rows
+
+    def _unpack_occurrences(self, rows):
+        events = dict((event.pk, event) for event in self.events)
+        field_names = [field.attname for field in Occurrence._meta.concrete_fields]
+        occurrences = []
+        for event_id, start, end, values in rows:
+            if values is not None:
+                occurrence = Occurrence.from_db(None, field_names, values)
+                occurrence.event = events[occurrence.event_id]
+            else:
+                occurrence = events[event_id]._create_occurrence(start, end)
+            occurrences.append(occurrence)
+        return occurrences
 
     def cached_get_sorted_occurrences(self):
         if hasattr(self, '_occurrences'):
@@ -88,33 +262,77 @@ class Period(object):
         return occs
     occurrences = property(cached_get_sorted_occurrences)
 
+    def iter_occurrences(self):
+        """
+        Returns an iterator over the occurrences of this period ordered by
+        start and end. Unless they were already computed, the events are
+        expanded lazily and merged as they go (see
+        schedule.expansion.iter_occurrences), so long periods can be streamed
+        without holding all of their occurrences.
+        """
+        if self.occurrence_pool is not None or hasattr(self, '_occurrences'):
+            return iter(sorted(self.occurrences, key=lambda occurrence: (occurrence.start, occurrence.end)))
+        return iter_occurrences(self.events, self.start, self.end, self.get_persisted_occurrences())
+
+    def get_occurrence_pool(self):
+        """
+        Returns the OccurrencePool handed down to the sub-periods of this
+        period, built once from its occurrences.
+        """
+        if not hasattr(self, '_occurrence_pool'):
+            self._occurrence_pool = OccurrencePool(self.occurrences)
+        return self._occurrence_pool
+
     def get_persisted_occurrences(self):
-        if hasattr(self, '_persisted_occurrenes'):
-            return self._persisted_occurrences
-        else:
-            self._persisted_occurrences = Occurrence.objects.filter(event__in=self.events)
-            return self._persisted_occurrences
+        """
+        Returns the persisted occurrences that can show up in this period,
+        loaded once and shared with every sub-period (see
+        OccurrenceManager.in_window).
+        """
+        if not hasattr(self, '_persisted_occurrences'):
+            self._persisted_occurrences = list(Occurrence.objects.in_window(
+                self.utc_start, self.utc_end).filter(event__in=self.events))
+        return self._persisted_occurrences
 
     def classify_occurrence(self, occurrence):
-        if occurrence.cancelled and not SHOW_CANCELLED_OCCURRENCES:
-            return
-        if occurrence.start > self.end or occurrence.end < self.start:
-            return None
-        started = False
-        ended = False
-        if self.utc_start <= occurrence.start < self.utc_end:
-            started = True
-        if self.utc_start <= occurrence.end < self.utc_end:
-            ended = True
-        if started and ended:
-            return {'occurrence': occurrence, 'class': 1}
-        elif started:
-            return {'occurrence': occurrence, 'class': 0}
-        elif ended:
-            return {'occurrence': occurrence, 'class': 3}
-        # it existed during this period but it didn't begin or end within it
-        # so it must have just continued
-        return {'occurrence': occurrence, 'class': 2}
+        return classify_occurrence(occurrence, self.utc_start, self.utc_end)
+
+    def get_day_buckets(self):
+        """
+        Returns the occurrence partials of every day of this period, keyed by
+        the utc start of the day. They are classified in a single sweep over
+        the sorted occurrences, and sub-periods created from this period
+        inherit them, so each Day of a month or year grid reads its partials
+        from here instead of classifying them again.
+        """
+        if self.day_buckets is None:
+            day_starts = self._get_day_starts()
+            buckets = [[] for day_start in day_starts[:-1]]
+            for occurrence in self.occurrences:
+                # the days from the one ending at or after its start to the
+                # last one starting at or before its end
+                first = max(bisect_left(day_starts, occurrence.start) - 1, 0)
+                last = min(bisect_right(day_starts, occurrence.end) - 1, len(buckets) - 1)
+                for i in range(first, last + 1):
+                    partial = classify_occurrence(occurrence, day_starts[i], day_starts[i + 1])
+                    if partial:
+                        buckets[i].append(partial)
+            self.day_buckets = dict(zip(day_starts, buckets))
+        return self.day_buckets
+
+    def _get_day_starts(self):
+        """
+        Returns the utc start of every local day of this period, followed by
+        the end of the last one.
+        """
+        first, last = self.start.date(), self.end.date()
+        if self.end.time() != datetime.time.min:
+            # the period ends within its last local day
+            last += datetime.timedelta(days=1)
+        if self.tzinfo is not None:
+            return get_day_boundaries(self.tzinfo, first, last)
+        return [datetime.datetime.combine(first + datetime.timedelta(days=i), datetime.time.min)
+                .replace(tzinfo=self.utc_start.tzinfo) for i in range((last - first).days + 1)]
 
     def get_occurrence_partials(self):
         occurrence_dicts = []
@@ -130,49 +348,70 @@ class Period(object):
     def has_occurrences(self):
         return any(self.classify_occurrence(o) for o in self.occurrences)
 
+    def get_busy_ranges(self):
+        """
+        Returns the (start, end) ranges of this period during which at least
+        one of its occurrences is going on, merged in a single pass over
+        iter_occurrences, see schedule.utils.iter_busy_ranges.
+        """
+        return list(iter_busy_ranges(self.iter_occurrences(), self.start, self.end))
+
     def get_time_slot(self, start, end, tzinfo=None):
         if start >= self.start and end <= self.end:
-            return Period(self.events, start, end, tzinfo)
+            return Period(self.events, start, end, self.get_persisted_occurrences())
         return None
 
     def create_sub_period(self, cls, start=None, tzinfo=None):
         if tzinfo is None:
             tzinfo = self.tzinfo
         start = start or self.start
-        return cls(self.events, start, self.get_persisted_occurrences(), self.occurrences, tzinfo)
+        period = cls(self.events, start, self.get_persisted_occurrences(), self.get_occurrence_pool(), tzinfo)
+        period.day_buckets = self.day_buckets
+        return period
 
     def get_periods(self, cls, tzinfo=None):
         if tzinfo is None:
             tzinfo = self.tzinfo
-        period = self.create_sub_period(cls)
+        period = self.create_sub_period(cls, self.start, tzinfo)
         while period.start < self.end:
-            yield self.create_sub_period(cls, period.start, tzinfo)
-            period = next(period)
+            yield period
+            period = self.create_sub_period(cls, period.end, tzinfo)
 
     @property
     def start(self):
-        if self.tzinfo is not None:
-            return self.utc_start.astimezone(self.tzinfo)
-        return self.utc_start.replace(tzinfo=None)
+        if not hasattr(self, '_start'):
+            if self.tzinfo is not None:
+                self._start = self.utc_start.astimezone(self.tzinfo)
+            else:
+                self._start = self.utc_start.replace(tzinfo=None)
+        return self._start
 
     @property
     def end(self):
-        if self.tzinfo is not None:
-            return self.utc_end.astimezone(self.tzinfo)
-        return self.utc_end.replace(tzinfo=None)
+        if not hasattr(self, '_end'):
+            if self.tzinfo is not None:
+                self._end = self.utc_end.astimezone(self.tzinfo)
+            else:
+                self._end = self.utc_end.replace(tzinfo=None)
+        return self._end
 
 
 class Year(Period):
-    def __init__(self, events, date=None, parent_persisted_occurrences=None, tzinfo=pytz.utc):
+    def __init__(self, events, date=None, parent_persisted_occurrences=None, tzinfo=pytz.utc, engine=None):
         self.tzinfo = self._get_tzinfo(tzinfo)
         if date is None:
             date = timezone.now()
         start, end = self._get_year_range(date)
-        super(Year, self).__init__(events, start, end, parent_persisted_occurrences, tzinfo=tzinfo)
+        super(Year, self).__init__(events, start, end, parent_persisted_occurrences, tzinfo=tzinfo, engine=engine)
 
     def get_months(self):
         return self.get_periods(Month)
 
+    def create_sub_period(self, cls, start=None, tzinfo=None):
+        # classify the occurrences of every day of the grid in one pass
+        self.get_day_buckets()
+        return super(Year, self).create_sub_period(cls, start, tzinfo)
+
     def next_year(self):
         return Year(self.events, self.end, tzinfo=self.tzinfo)
     next = next_year
@@ -193,10 +432,8 @@ class Year(Period):
         start = naive_start
         end = naive_end
         if self.tzinfo is not None:
-            local_start = self.tzinfo.localize(naive_start)
-            local_end = self.tzinfo.localize(naive_end)
-            start = local_start.astimezone(pytz.utc)
-            end = local_end.astimezone(pytz.utc)
+            start = get_day_boundary(self.tzinfo, naive_start.date())
+            end = get_day_boundary(self.tzinfo, naive_end.date())
 
         return start, end
 
@@ -210,17 +447,22 @@ class Month(Period):
     and day periods within the date.
     """
     def __init__(self, events, date=None, parent_persisted_occurrences=None,
-                 occurrence_pool=None, tzinfo=pytz.utc):
+                 occurrence_pool=None, tzinfo=pytz.utc, engine=None):
         self.tzinfo = self._get_tzinfo(tzinfo)
         if date is None:
             date = timezone.now()
         start, end = self._get_month_range(date)
         super(Month, self).__init__(events, start, end,
-                                    parent_persisted_occurrences, occurrence_pool, tzinfo=tzinfo)
+                                    parent_persisted_occurrences, occurrence_pool, tzinfo=tzinfo, engine=engine)
 
     def get_weeks(self):
         return self.get_periods(Week)
 
+    def create_sub_period(self, cls, start=None, tzinfo=None):
+        # classify the occurrences of every day of the grid in one pass
+        self.get_day_buckets()
+        return super(Month, self).create_sub_period(cls, start, tzinfo)
+
     def get_days(self):
         return self.get_periods(Day)
 
@@ -266,10 +508,8 @@ class Month(Period):
         start = naive_start
         end = naive_end
         if self.tzinfo is not None:
-            local_start = self.tzinfo.localize(naive_start)
-            local_end = self.tzinfo.localize(naive_end)
-            start = local_start.astimezone(pytz.utc)
-            end = local_end.astimezone(pytz.utc)
+            start = get_day_boundary(self.tzinfo, naive_start.date())
+            end = get_day_boundary(self.tzinfo, naive_end.date())
 
         return start, end
 
@@ -288,13 +528,13 @@ class Week(Period):
     The Week period that has functions for retrieving Day periods within it
     """
     def __init__(self, events, date=None, parent_persisted_occurrences=None,
-                 occurrence_pool=None, tzinfo=pytz.utc):
+                 occurrence_pool=None, tzinfo=pytz.utc, engine=None):
         self.tzinfo = self._get_tzinfo(tzinfo)
         if date is None:
             date = timezone.now()
         start, end = self._get_week_range(date)
         super(Week, self).__init__(events, start, end,
-                                   parent_persisted_occurrences, occurrence_pool, tzinfo=tzinfo)
+                                   parent_persisted_occurrences, occurrence_pool, tzinfo=tzinfo, engine=engine)
 
     def prev_week(self):
         return Week(self.events, self.start - datetime.timedelta(days=7), tzinfo=self.tzinfo)
@@ -335,10 +575,8 @@ class Week(Period):
         naive_end = naive_start + datetime.timedelta(days=7)
 
         if self.tzinfo is not None:
-            local_start = self.tzinfo.localize(naive_start)
-            local_end = self.tzinfo.localize(naive_end)
-            start = local_start.astimezone(pytz.utc)
-            end = local_end.astimezone(pytz.utc)
+            start = get_day_boundary(self.tzinfo, naive_start.date())
+            end = get_day_boundary(self.tzinfo, naive_end.date())
         else:
             start = naive_start
             end = naive_end
@@ -355,13 +593,13 @@ class Week(Period):
 
 class Day(Period):
     def __init__(self, events, date=None, parent_persisted_occurrences=None,
-                 occurrence_pool=None, tzinfo=pytz.utc):
+                 occurrence_pool=None, tzinfo=pytz.utc, engine=None):
         self.tzinfo = self._get_tzinfo(tzinfo)
         if date is None:
             date = timezone.now()
         start, end = self._get_day_range(date)
         super(Day, self).__init__(events, start, end,
-                                  parent_persisted_occurrences, occurrence_pool, tzinfo=tzinfo)
+                                  parent_persisted_occurrences, occurrence_pool, tzinfo=tzinfo, engine=engine)
 
     def _get_day_range(self, date):
         if isinstance(date, datetime.datetime):
@@ -370,10 +608,8 @@ class Day(Period):
         naive_start = datetime.datetime.combine(date, datetime.time.min)
         naive_end = datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time.min)
         if self.tzinfo is not None:
-            local_start = self.tzinfo.localize(naive_start)
-            local_end = self.tzinfo.localize(naive_end)
-            start = local_start.astimezone(pytz.utc)
-            end = local_end.astimezone(pytz.utc)
+            start = get_day_boundary(self.tzinfo, naive_start.date())
+            end = get_day_boundary(self.tzinfo, naive_end.date())
         else:
             start = naive_start
             end = naive_end
@@ -406,3 +642,13 @@ class Day(Period):
 
     def current_week(self):
         return Week(self.events, self.start, tzinfo=self.tzinfo)
+
+    def get_occurrence_partials(self):
+        if self.day_buckets is not None and self.utc_start in self.day_buckets:
+            return self.day_buckets[self.utc_start]
+        return super(Day, self).get_occurrence_partials()
+
+    def has_occurrences(self):
+        if self.day_buckets is not None and self.utc_start in self.day_buckets:
+            return bool(self.day_buckets[self.utc_start])
+        return super(Day, self).has_occurrences()
@@ -1,7 +1,12 @@
 from __future__ import absolute_import
-from django.db.models.signals import pre_save
+from django.core.signals import request_finished
+from django.db.models.signals import pre_save, post_save, post_delete
 
-from .models import Event, Calendar
+from schedule.conf import settings
+from .models import Event, EventRelation, Calendar, Occurrence, OccurrenceIndex, Rule
+from .models.events import rrule_cache, flush_checkpoints
+from .models.rules import rule_registry
+from .utils import bump_calendar_version, get_period_cache
 
 def optionnal_calendar(sender, **kwargs):
     event = kwargs.pop('instance')
@@ -21,3 +26,72 @@ def optionnal_calendar(sender, **kwargs):
     except:
         return True
 pre_save.connect(optionnal_calendar)
+
+
+def update_event_occurrence_index(sender, instance, **kwargs):
+    # Rebuilding takes a row per occurrence of the horizon, which the
+    # update_occurrence_index command does out of the request.
+    if settings.USE_OCCURRENCE_INDEX:
+        OccurrenceIndex.objects.invalidate_events([instance.pk])
+        instance.indexed_from = instance.indexed_until = None
+post_save.connect(update_event_occurrence_index, sender=Event)
+
+
+def update_rule_occurrence_index(sender, instance, **kwargs):
+    # A rule may be shared by many events, see update_event_occurrence_index.
+    if settings.USE_OCCURRENCE_INDEX:
+        OccurrenceIndex.objects.invalidate_rule(instance)
+post_save.connect(update_rule_occurrence_index, sender=Rule)
+
+
+def update_occurrence_occurrence_index(sender, instance, **kwargs):
+    if settings.USE_OCCURRENCE_INDEX:
+        OccurrenceIndex.objects.update_for_occurrence(instance)
+post_save.connect(update_occurrence_occurrence_index, sender=Occurrence)
+
+
+def invalidate_occurrence_index(sender, instance, **kwargs):
+    # The event may be going away in the same cascade, so only mark its rows
+    # as stale instead of rebuilding them here.
+    if settings.USE_OCCURRENCE_INDEX:
+        OccurrenceIndex.objects.invalidate_events([instance.event_id])
+post_delete.connect(invalidate_occurrence_index, sender=Occurrence)
+
+
+def invalidate_rrule_cache(sender, instance, **kwargs):
+    rule_id = instance.pk if isinstance(instance, Rule) else instance.rule_id
+    if rule_id is not None:
+        rrule_cache.invalidate(lambda key: key[0] == rule_id)
+post_save.connect(invalidate_rrule_cache, sender=Rule)
+post_delete.connect(invalidate_rrule_cache, sender=Rule)
+post_save.connect(invalidate_rrule_cache, sender=Event)
+
+
+def invalidate_rule_registry(sender, instance, **kwargs):
+    rule_id = instance.pk
+    rule_registry.invalidate(lambda key: key[0] == rule_id)
+post_save.connect(invalidate_rule_registry, sender=Rule)
+post_delete.connect(invalidate_rule_registry, sender=Rule)
+
+
+def invalidate_period_cache(sender, instance, **kwargs):
+    if get_period_cache() is None:
+        return
+    if isinstance(instance, Event):
+        calendar_ids = [instance.calendar_id]
+    elif isinstance(instance, Rule):
+        calendar_ids = Event.objects.filter(rule=instance).values_list('calendar_id', flat=True).distinct()
+    else:
+        calendar_ids = Event.objects.filter(pk=instance.event_id).values_list('calendar_id', flat=True)
+    for calendar_id in calendar_ids:
+        bump_calendar_version(calendar_id)
+for model in (Event, Occurrence, Rule, EventRelation):
+    post_save.connect(invalidate_period_cache, sender=model)
+    post_delete.connect(invalidate_period_cache, sender=model)
+
+
+def save_checkpoints(sender, **kwargs):
+    # get_occurrences writes its checkpoints itself, this only catches those
+    # left queued by an expansion that raised
+    flush_checkpoints()
+request_finished.connect(save_checkpoints)
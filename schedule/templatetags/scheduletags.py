@@ -237,6 +237,20 @@ def detail(occurrence):
     return context
 
 
+class CookedOccurrence(object):
+    """
+    An occurrence laid out by _cook_occurrences. It holds the position and
+    size of the occurrence in the daily table and reads every other attribute
+    from the occurrence itself.
+    """
+
+    def __init__(self, occurrence):
+        self.occurrence = occurrence
+
+    def __getattr__(self, name):
+        return getattr(self.occurrence, name)
+
+
 def _cook_occurrences(period, occs, width, height):
     """ Prepare occurrences to be displayed.
         Calculate dimensions and position (in px) for each occurrence.
@@ -250,6 +264,8 @@ def _cook_occurrences(period, occs, width, height):
         height - height of the table (px)
     """
     last = {}
+    # generated occurrences are slotted, keep the layout on a wrapper
+    occs = [CookedOccurrence(o) for o in occs]
     # find out which occurrences overlap
     for o in occs[:]:
         o.data = period.classify_occurrence(o)
@@ -6,12 +6,16 @@ from schedule.feeds import UpcomingEventsFeed
 from schedule.feeds import CalendarICalendar
 from schedule.periods import Year, Month, Week, Day
 from schedule.views import (
+    api_freebusy,
     api_occurrences,
+    api_occurrences_after,
+    api_occurrences_bulk,
     DeleteEventView,
     event,
     calendar,
     calendar_by_periods,
     create_or_edit_event,
+    freebusy_ical,
     occurrence,
     cancel_occurrence,
     edit_occurrence,
@@ -103,7 +107,19 @@ urlpatterns = [
     url(r'^ical/calendar/(.*)/$',
         CalendarICalendar(),
         name='calendar_ical'),
+    url(r'^ical/freebusy/$',
+        freebusy_ical,
+        name='freebusy_ical'),
     #api urls
+    url(r'^api/freebusy',
+        api_freebusy,
+        name='api_freebusy'),
+    url(r'^api/occurrences/bulk',
+        api_occurrences_bulk,
+        name='api_occurrences_bulk'),
+    url(r'^api/occurrences/after',
+        api_occurrences_after,
+        name='api_occurrences_after'),
     url(r'^api/occurrences',
         api_occurrences,
         name='api_occurences'),
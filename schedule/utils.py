@@ -1,13 +1,22 @@
 from __future__ import absolute_import
+from collections import OrderedDict
 from functools import wraps
+import datetime
+import hashlib
 import pytz
 import heapq
+import threading
+import time
 from annoying.functions import get_object_or_None
 from django.http import HttpResponseRedirect
 from django.conf import settings
+from django.db.models import Count, Max
+from django.views.decorators.http import condition
 from django.utils import timezone
+from schedule.conf import settings as schedule_settings
 from schedule.conf.settings import CHECK_EVENT_PERM_FUNC, CHECK_CALENDAR_PERM_FUNC
 import os
+import six
 
 def get_boolean(flag, default):
     """
@@ -22,6 +31,128 @@ def get_boolean(flag, default):
         return os.environ.get(flag).lower() == 'true'
     return default
 
+class LRUCache(object):
+    """
+    A thread safe mapping holding at most ``maxsize`` items. When it is full
+    the least recently used item is evicted. Hits and misses are counted so
+    the cache can be sized from its stats.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, predicate):
+        """
+        Removes every item whose key satisfies ``predicate``.
+        """
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+
+def get_period_cache():
+    """
+    Returns the Django cache that holds the occurrences of periods across
+    requests, or None if PERIOD_CACHE is not set.
+    """
+    if not schedule_settings.PERIOD_CACHE:
+        return None
+    from django.core.cache import caches
+    return caches[schedule_settings.PERIOD_CACHE]
+
+
+def _calendar_version_key(calendar_id):
+    return 'schedule:calendar_version:%s' % (calendar_id,)
+
+
+def get_calendar_versions(calendar_ids):
+    """
+    Returns the current version of each calendar in ``calendar_ids`` as a
+    dict, which is empty if PERIOD_CACHE is not set. Versions are kept in
+    PERIOD_CACHE; a calendar without one (new or evicted) starts from the
+    current time so it never reuses the version of older cached entries.
+    """
+    cache = get_period_cache()
+    if cache is None:
+        return {}
+    keys = dict((_calendar_version_key(calendar_id), calendar_id) for calendar_id in calendar_ids)
+    versions = dict((keys[key], version) for key, version in cache.get_many(list(keys)).items())
+    for key, calendar_id in keys.items():
+        if calendar_id not in versions:
+            cache.add(key, int(time.time() * 1000000), None)
+            versions[calendar_id] = cache.get(key)
+    return versions
+
+
+def bump_calendar_version(calendar_id):
+    """
+    Invalidates every cached period that includes events of the calendar,
+    along with the validators of the views showing it.
+    """
+    cache = get_period_cache()
+    if cache is None:
+        return
+    key = _calendar_version_key(calendar_id)
+    # versions are times in microseconds so that they can move Last-Modified
+    # forward, see get_calendar_validators
+    version = int(time.time() * 1000000)
+    current = cache.get(key)
+    if current is not None and current >= version:
+        version = current + 1
+    cache.set(key, version, None)
+
+
+def get_version_datetime(version):
+    """
+    Returns the date of a calendar version, in the current timezone if
+    USE_TZ is off like the dates read from the database.
+    """
+    dt = pytz.utc.localize(datetime.datetime.utcfromtimestamp(version / 1000000.0))
+    if not settings.USE_TZ:
+        return timezone.make_naive(dt, timezone.get_default_timezone())
+    return dt
+
+
 class EventListManager(object):
     """
     This class is responsible for doing functions on a list of events. It is
@@ -44,7 +175,7 @@ class EventListManager(object):
         if after is None:
             after = timezone.now()
         occ_replacer = OccurrenceReplacer(
-            Occurrence.objects.filter(event__in=self.events))
+            Occurrence.objects.in_window(after).filter(event__in=self.events))
         generators = [event._occurrences_after_generator(after) for event in self.events]
         occurrences = []
 
@@ -98,6 +229,88 @@ class OccurrenceReplacer(object):
         """
         return [occ for key, occ in self.lookup.items() if (occ.start < end and occ.end >= start and not occ.cancelled)]
 
+    def merge(self, occurrences, start, end):
+        """
+        Returns the generated ``occurrences`` of the period from start to end
+        with their persisted counterparts swapped in, followed by the
+        persisted occurrences that were moved into the period.
+        """
+        if not self.lookup:
+            # nothing to replace, which also holds for unsaved events
+            return list(occurrences)
+        final_occurrences = []
+        for occ in occurrences:
+            # replace occurrences with their persisted counterparts
+            if self.has_occurrence(occ):
+                p_occ = self.get_occurrence(occ)
+                # ...but only if they are within this period
+                if p_occ.start <= end and p_occ.end >= start:
+                    final_occurrences.append(p_occ)
+            else:
+                final_occurrences.append(occ)
+        # then add persisted occurrences which originated outside of this period but now
+        # fall within it
+        final_occurrences += self.get_additional_occurrences(start, end)
+        return final_occurrences
+
+
+def find_overlaps(occurrences, others):
+    """
+    Returns the (occurrence, other) pairs of an occurrence of
+    ``occurrences`` and one of ``others`` that overlap, that is where each
+    one starts before the other ends. Cancelled occurrences never overlap.
+
+    Both lists are swept together in start order while the occurrences still
+    running are kept on a heap by end, so it takes O((n + k) log n) for n
+    occurrences and k overlaps instead of comparing every pair.
+    """
+    timeline = []
+    for side, items in enumerate((occurrences, others)):
+        for position, occurrence in enumerate(items):
+            if not occurrence.cancelled:
+                timeline.append((occurrence.start, side, position, occurrence))
+    timeline.sort(key=lambda item: item[:3])
+    running = ([], [])
+    overlaps = []
+    for start, side, position, occurrence in timeline:
+        # heap entries are (end, position, occurrence)
+        other_running = running[1 - side]
+        while other_running and other_running[0][0] <= start:
+            heapq.heappop(other_running)
+        for end, other_position, other in other_running:
+            overlaps.append((occurrence, other) if side == 0 else (other, occurrence))
+        heapq.heappush(running[side], (occurrence.end, position, occurrence))
+    return overlaps
+
+
+def iter_busy_ranges(occurrences, start=None, end=None):
+    """
+    Yields the (start, end) ranges during which at least one of
+    ``occurrences``, given in start order, is going on, clipped to the
+    window from start to end when given. Overlapping and adjacent
+    occurrences are merged in a single pass, and cancelled occurrences are
+    left out.
+    """
+    busy_start = busy_end = None
+    for occurrence in occurrences:
+        if occurrence.cancelled:
+            continue
+        o_start, o_end = occurrence.start, occurrence.end
+        if start is not None:
+            o_start = max(o_start, start)
+        if end is not None:
+            o_end = min(o_end, end)
+        if o_start >= o_end:
+            continue
+        if busy_end is not None and o_start <= busy_end:
+            busy_end = max(busy_end, o_end)
+            continue
+        if busy_end is not None:
+            yield busy_start, busy_end
+        busy_start, busy_end = o_start, o_end
+    if busy_end is not None:
+        yield busy_start, busy_end
+
 
 def check_event_permissions(function):
     @wraps(function)
@@ -126,6 +339,118 @@ def check_event_permissions(function):
     return decorator
 
 
+# pytz timezones by name, see get_timezone.
+timezone_cache = LRUCache(100)
+
+
+def get_timezone(name):
+    """
+    Returns the pytz timezone called ``name``, raising
+    pytz.UnknownTimeZoneError if there is none. Timezones are kept in
+    timezone_cache so that looking one up again is a dict lookup.
+    """
+    tz = timezone_cache.get(name)
+    if tz is None:
+        tz = pytz.timezone(name)
+        timezone_cache.set(name, tz)
+    return tz
+
+
+def get_request_timezone(request):
+    """
+    Returns the timezone of ``request``: the one named by its ``tz`` query
+    parameter, else the ``django_timezone`` of its session, else UTC. The
+    session is only read, never written, and ``tz`` lets the url alone
+    determine the timezone for shared caches. The timezone is memoized on
+    the request, see TimezoneMiddleware.
+    """
+    tz = getattr(request, 'schedule_timezone', None)
+    if tz is not None:
+        return tz
+    tz = pytz.utc
+    for get_name in (lambda: request.GET.get('tz'),
+                     lambda: getattr(request, 'session', {}).get('django_timezone')):
+        name = get_name()
+        if name:
+            try:
+                tz = get_timezone(name)
+                break
+            except pytz.UnknownTimeZoneError:
+                pass
+    request.schedule_timezone = tz
+    return tz
+
+
+def get_calendar_validators(request, calendar_lookup, now_dependent=False):
+    """
+    Returns the (etag, last_modified) validators of a response showing the
+    calendars matching ``calendar_lookup`` for this request, computed with
+    two aggregate queries and without expanding any occurrence.
+
+    The etag covers the number and last update of the events, event relations
+    and persisted occurrences of the calendars, the last update of the rules
+    of their events, the full path, the user and their timezone. All of these
+    are read from the database, so every process agrees on them. When
+    PERIOD_CACHE is set, the versions of the calendars (bumped by every save
+    and deletion of their events, occurrences, rules and event relations) are
+    covered as well, so that deletions also move last_modified forward. The
+    last_modified is the latest of these updates and versions. A response
+    that depends on the current date gets the current hour in its etag and no
+    last_modified.
+    """
+    from schedule.models import Calendar, Event, Occurrence
+    calendar_ids = sorted(Calendar.objects.filter(**calendar_lookup).values_list('pk', flat=True))
+    if not calendar_ids:
+        return None, None
+    events = Event.objects.filter(calendar__in=calendar_ids).aggregate(
+        count=Count('pk', distinct=True), updated_on=Max('updated_on'),
+        rule_updated_on=Max('rule__updated_on'),
+        relation_count=Count('eventrelation', distinct=True), relation_updated_on=Max('eventrelation__updated_on'))
+    occurrences = Occurrence.objects.filter(event__calendar__in=calendar_ids).aggregate(
+        count=Count('pk'), updated_on=Max('updated_on'))
+    updates = [d for d in (events['updated_on'], events['rule_updated_on'], events['relation_updated_on'],
+                           occurrences['updated_on']) if d is not None]
+    versions = sorted(get_calendar_versions(calendar_ids).items())
+    if versions:
+        updates.append(get_version_datetime(max(version for pk, version in versions)))
+    last_modified = max(updates) if updates else None
+    user = getattr(request, 'user', None)
+    key = [
+        calendar_ids, versions,
+        events['count'], events['relation_count'], occurrences['count'],
+        last_modified and last_modified.isoformat(),
+        request.get_full_path(),
+        user.pk if user is not None and user.is_authenticated() else None,
+        get_request_timezone(request).zone,
+    ]
+    if now_dependent:
+        key.append(timezone.now().strftime('%Y%m%d%H'))
+        last_modified = None
+    key = u'|'.join(six.text_type(part) for part in key)
+    return hashlib.md5(key.encode('utf-8')).hexdigest(), last_modified
+
+
+def calendar_condition(get_calendar_lookup, now_dependent=False):
+    """
+    Decorator answering conditional GETs of a calendar view with a 304 before
+    the view runs, see get_calendar_validators. ``get_calendar_lookup`` is
+    called with the arguments of the view and returns the Calendar lookup of
+    the calendars it shows.
+    """
+    def decorator(view):
+        def get_validators(request, *args, **kwargs):
+            if not hasattr(request, '_calendar_validators'):
+                request._calendar_validators = get_calendar_validators(
+                    request, get_calendar_lookup(request, *args, **kwargs), now_dependent)
+            return request._calendar_validators
+
+        return condition(
+            etag_func=lambda request, *args, **kwargs: get_validators(request, *args, **kwargs)[0],
+            last_modified_func=lambda request, *args, **kwargs: get_validators(request, *args, **kwargs)[1],
+        )(view)
+    return decorator
+
+
 def coerce_date_dict(date_dict):
     """
     given a dictionary (presumed to be from request.GET) it returns a tuple
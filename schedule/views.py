@@ -1,23 +1,34 @@
 from __future__ import absolute_import
+import base64
+import itertools
 import json
+import operator
 import pytz
 import datetime
+from functools import reduce
 from six.moves.urllib.parse import quote
 
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, get_object_or_404
 from django.utils import timezone
 from django.http import HttpResponseRedirect, Http404
 from django.core.urlresolvers import reverse
+from django.db.models.query import QuerySet
 from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_POST
 from django.views.generic.edit import DeleteView
 
-from schedule.conf.settings import GET_EVENTS_FUNC, OCCURRENCE_CANCEL_REDIRECT
+from schedule.conf import settings
+from schedule.conf.settings import (
+    CHECK_CALENDAR_PERM_FUNC, CHECK_EVENT_PERM_FUNC, GET_EVENTS_FUNC, OCCURRENCE_CANCEL_REDIRECT)
+from schedule.expansion import get_occurrence_cursor, iter_occurrences, iter_occurrences_after
+from schedule.feeds.icalendar import freebusy_to_ical
 from schedule.forms import EventForm, OccurrenceForm
-from schedule.models import Calendar, Occurrence, Event
+from schedule.models import Calendar, Occurrence, Event, OccurrenceIndex
 from schedule.periods import weekday_names
-from schedule.utils import check_event_permissions, coerce_date_dict
+from schedule.utils import (
+    calendar_condition, check_event_permissions, coerce_date_dict, get_request_timezone, iter_busy_ranges)
 
 
 def calendar(request, calendar_slug, template='schedule/calendar.html'):
@@ -38,6 +49,25 @@ def calendar(request, calendar_slug, template='schedule/calendar.html'):
     })
 
 
+def get_events_for_calendars(request, calendars):
+    """
+    Returns the events of all ``calendars`` given by GET_EVENTS_FUNC. When it
+    returns querysets, as it does by default, they are combined so that the
+    events of every calendar are fetched with a single query.
+    """
+    event_lists = [GET_EVENTS_FUNC(request, calendar) for calendar in calendars]
+    if len(event_lists) == 1:
+        return event_lists[0]
+    if all(isinstance(event_list, QuerySet) for event_list in event_lists):
+        return reduce(operator.or_, event_lists).select_related('calendar')
+    return list(itertools.chain(*event_lists))
+
+
+def _get_periods_calendar_lookup(request, calendar_slug, *args, **kwargs):
+    return {'slug__in': [calendar_slug] + request.GET.getlist('overlay')}
+
+
+@calendar_condition(_get_periods_calendar_lookup, now_dependent=True)
 def calendar_by_periods(request, calendar_slug, periods=None, template_name="schedule/calendar_by_period.html"):
     """
     This view is for getting a calendar, but also getting periods with that
@@ -66,6 +96,12 @@ def calendar_by_periods(request, calendar_slug, periods=None, template_name="sch
     ``calendar``
         This is the Calendar that is designated by the ``calendar_slug``.
 
+    ``calendars``
+        The calendars shown: the one designated by the ``calendar_slug``,
+        followed by the calendars whose slugs are given as ``overlay`` in
+        request.GET. Their events are fetched with a single query and
+        ``occurrence.calendar`` tells their occurrences apart.
+
     ``weekday_names``
         This is for convenience. It returns the local names of weekedays for
         internationalization.
@@ -84,9 +120,12 @@ def calendar_by_periods(request, calendar_slug, periods=None, template_name="sch
             raise Http404
     else:
         date = timezone.now()
-    event_list = GET_EVENTS_FUNC(request, calendar)
-    local_timezone = request.session.setdefault('django_timezone', 'UTC')
-    local_timezone = pytz.timezone(local_timezone)
+    overlay = request.GET.getlist('overlay')
+    calendars = [calendar]
+    if overlay:
+        calendars += list(Calendar.objects.filter(slug__in=overlay).exclude(pk=calendar.pk))
+    event_list = get_events_for_calendars(request, calendars)
+    local_timezone = get_request_timezone(request)
     period_objects = {}
     for period in periods:
         if period.__name__.lower() == 'year':
@@ -97,6 +136,7 @@ def calendar_by_periods(request, calendar_slug, periods=None, template_name="sch
         'date': date,
         'periods': period_objects,
         'calendar': calendar,
+        'calendars': calendars,
         'weekday_names': weekday_names,
         'here': quote(request.get_full_path()),
     }, )
@@ -330,19 +370,208 @@ def get_next_url(request, default):
     return next
 
 
+@calendar_condition(lambda request: {'slug': request.GET.get('calendar_slug')})
 def api_occurrences(request):
+    """
+    Returns the occurrences of a calendar from ``start`` to ``end`` as JSON.
+    With ``stream`` set, occurrences are expanded lazily and sent in start
+    order as they are generated, so memory stays flat for long windows and
+    the response starts before the expansion is over.
+    """
     utc=pytz.UTC
     start = utc.localize(datetime.datetime.utcfromtimestamp(float(request.GET.get('start'))))
     end = utc.localize(datetime.datetime.utcfromtimestamp(float(request.GET.get('end'))))
     calendar = get_object_or_404(Calendar, slug=request.GET.get('calendar_slug'))
-    response_data =[]
-    for event in calendar.events.filter(start__gte=start, end__lte=end):
-        occurrences = event.get_occurrences(start, end)
-        for occurrence in occurrences:
-            response_data.append({
-                "id": occurrence.id,
-                "title": occurrence.title,
-                "start": occurrence.start.isoformat(),
-                "end": occurrence.end.isoformat(),
-            })
+    events = calendar.events.in_window(start, end).select_related('rule')
+    if request.GET.get('stream'):
+        return StreamingHttpResponse(
+            iter_json_list(serialize_occurrence(occurrence)
+                           for occurrence in iter_occurrences(events, start, end)),
+            content_type="application/json")
+    occurrences = None
+    if settings.USE_OCCURRENCE_INDEX:
+        occurrences = OccurrenceIndex.objects.get_occurrences(events, start, end)
+    if occurrences is None:
+        occurrences = Event.objects.get_occurrences_for(events, start, end)
+    response_data = [serialize_occurrence(occurrence) for occurrence in occurrences]
     return HttpResponse(json.dumps(response_data), content_type="application/json")
+
+
+@calendar_condition(lambda request: {'slug': request.GET.get('calendar_slug')}, now_dependent=True)
+def api_occurrences_after(request):
+    """
+    Returns as JSON the first ``limit`` occurrences of a calendar that end
+    after ``after``, which defaults to now, along with a ``next`` cursor.
+    Passing that cursor back returns the following page, for which every
+    event of the calendar is expanded from the cursor on rather than from its
+    start, see schedule.expansion.iter_occurrences_after.
+    """
+    cursor = request.GET.get('cursor')
+    if cursor:
+        try:
+            after, cursor = _decode_occurrence_cursor(cursor)
+        except (TypeError, ValueError, OverflowError, OSError):
+            return HttpResponseBadRequest("Invalid cursor")
+    elif request.GET.get('after'):
+        try:
+            after = pytz.utc.localize(datetime.datetime.utcfromtimestamp(float(request.GET.get('after'))))
+        except (ValueError, OverflowError, OSError):
+            return HttpResponseBadRequest("Invalid after")
+    else:
+        after = timezone.now()
+    page_size = settings.API_OCCURRENCES_PAGE_SIZE
+    try:
+        limit = max(min(int(request.GET.get('limit', page_size)), page_size), 1)
+    except (TypeError, ValueError):
+        return HttpResponseBadRequest("Invalid limit")
+    calendar = get_object_or_404(Calendar, slug=request.GET.get('calendar_slug'))
+    events = calendar.events.in_window(after).select_related('rule')
+    occurrences = list(itertools.islice(iter_occurrences_after(events, after, cursor), limit + 1))
+    next_cursor = None
+    if len(occurrences) > limit:
+        occurrences = occurrences[:limit]
+        next_cursor = _encode_occurrence_cursor(after, get_occurrence_cursor(occurrences[-1]))
+    response_data = {
+        "occurrences": [serialize_occurrence(occurrence) for occurrence in occurrences],
+        "next": next_cursor,
+    }
+    return HttpResponse(json.dumps(response_data), content_type="application/json")
+
+
+@require_POST
+def api_occurrences_bulk(request):
+    """
+    Cancels, uncancels or moves many occurrences at once. The body is a JSON
+    object whose ``changes`` list holds objects with an ``event_id``, the
+    ``original_start`` of the occurrence, an ``action`` and, to move it, its
+    new ``start`` and ``end``, dates being unix timestamps. All the changes
+    are applied or none, with a handful of queries whatever their number,
+    see OccurrenceManager.apply_changes, and the changed occurrences are
+    returned as JSON.
+    """
+    def to_datetime(timestamp):
+        return pytz.utc.localize(datetime.datetime.utcfromtimestamp(float(timestamp)))
+
+    try:
+        changes = json.loads(request.body.decode('utf-8'))['changes']
+        events = Event.objects.select_related('calendar', 'rule').in_bulk(
+            set(int(change['event_id']) for change in changes))
+        changes = [(events[int(change['event_id'])],
+                    to_datetime(change['original_start']),
+                    change['action'],
+                    to_datetime(change['start']) if change['action'] == 'move' else None,
+                    to_datetime(change['end']) if change['action'] == 'move' else None)
+                   for change in changes]
+    except (KeyError, TypeError, ValueError):
+        return HttpResponseBadRequest("Invalid changes")
+    for event in events.values():
+        if not (CHECK_EVENT_PERM_FUNC(event, request.user) and
+                CHECK_CALENDAR_PERM_FUNC(event.calendar, request.user)):
+            return HttpResponseForbidden()
+    for event, original_start, action, start, end in changes:
+        if action == 'move' and end <= start:
+            return HttpResponseBadRequest("The end time must be later than start time.")
+    try:
+        occurrences = Occurrence.objects.apply_changes(changes)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    response_data = [serialize_occurrence(occurrence) for occurrence in occurrences]
+    return HttpResponse(json.dumps(response_data), content_type="application/json")
+
+
+def _get_freebusy_calendar_lookup(request):
+    return {'slug__in': request.GET.getlist('calendar_slug')}
+
+
+def get_busy_ranges(request):
+    """
+    Returns the window from ``start`` to ``end`` in request.GET and the
+    ranges of that window during which the calendars whose slugs are given as
+    ``calendar_slug`` are busy. Their events are fetched with one query and
+    their occurrences merged in start order as they are expanded, so the
+    ranges are computed without holding every occurrence.
+    """
+    start = pytz.utc.localize(datetime.datetime.utcfromtimestamp(float(request.GET.get('start'))))
+    end = pytz.utc.localize(datetime.datetime.utcfromtimestamp(float(request.GET.get('end'))))
+    calendars = list(Calendar.objects.filter(**_get_freebusy_calendar_lookup(request)))
+    if not calendars:
+        raise Http404
+    events = Event.objects.in_window(start, end).filter(calendar__in=calendars).select_related('rule')
+    return start, end, iter_busy_ranges(iter_occurrences(events, start, end), start, end)
+
+
+@calendar_condition(_get_freebusy_calendar_lookup)
+def api_freebusy(request):
+    """
+    Returns as JSON the ranges from ``start`` to ``end`` during which the
+    calendars whose slugs are given as ``calendar_slug`` are busy, as
+    [start, end] pairs, see get_busy_ranges.
+    """
+    start, end, busy_ranges = get_busy_ranges(request)
+    response_data = {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "busy": [[busy_start.isoformat(), busy_end.isoformat()] for busy_start, busy_end in busy_ranges],
+    }
+    return HttpResponse(json.dumps(response_data), content_type="application/json")
+
+
+@calendar_condition(_get_freebusy_calendar_lookup)
+def freebusy_ical(request):
+    """
+    Returns the busy ranges of api_freebusy as an iCalendar VFREEBUSY.
+    """
+    start, end, busy_ranges = get_busy_ranges(request)
+    response = HttpResponse(freebusy_to_ical(busy_ranges, start, end))
+    response['Content-Type'] = 'text/calendar'
+    return response
+
+
+def _to_microseconds(dt):
+    delta = dt - datetime.datetime(1970, 1, 1, tzinfo=pytz.utc)
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _from_microseconds(value):
+    return datetime.datetime(1970, 1, 1, tzinfo=pytz.utc) + datetime.timedelta(microseconds=value)
+
+
+def _encode_occurrence_cursor(after, cursor):
+    start, event_id, original_start = cursor
+    values = [_to_microseconds(after), _to_microseconds(start), event_id, _to_microseconds(original_start)]
+    return base64.urlsafe_b64encode(','.join(str(value) for value in values).encode('ascii')).decode('ascii')
+
+
+def _decode_occurrence_cursor(cursor):
+    values = [int(value) for value in base64.urlsafe_b64decode(str(cursor)).decode('ascii').split(',')]
+    if len(values) != 4:
+        raise ValueError("Invalid cursor %r" % (cursor,))
+    after, start, event_id, original_start = values
+    return _from_microseconds(after), (_from_microseconds(start), event_id, _from_microseconds(original_start))
+
+
+def serialize_occurrence(occurrence):
+    return {
+        "id": occurrence.id,
+        "title": occurrence.title,
+        "start": occurrence.start.isoformat(),
+        "end": occurrence.end.isoformat(),
+    }
+
+
+def iter_json_list(items, chunk_size=100):
+    """
+    Encodes ``items`` as a JSON list, yielding a chunk every ``chunk_size``
+    items so that it can be streamed as they are produced.
+    """
+    encoder = json.JSONEncoder()
+    chunk = ['[']
+    for i, item in enumerate(items):
+        if i:
+            chunk.append(',')
+        chunk.append(encoder.encode(item))
+        if len(chunk) >= 2 * chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append(']')
+    yield ''.join(chunk)
@@ -43,6 +43,9 @@ setup(
         'coverage>=3.6',
         'pyyaml>=3.11',
     ],
+    extras_require={
+        'numpy': ['numpy>=1.9'],
+    },
     dependency_links = ['http://github.com/AltSchool/dateutil/tarball/master#egg=python-dateutil-2.1.post20140303'],
     license='BSD',
     test_suite='runtests.runtests',
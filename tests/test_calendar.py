@@ -59,6 +59,30 @@ class TestCalendar(TestCase):
         self.assertEquals(occurrences, [])
 #        self.assertEquals(list(calendar.occurrences_after(timezone.now())), [])
 
+    def test_get_conflicts(self):
+        calendar = Calendar.objects.create(name='Timetable')
+        start = datetime.datetime(2008, 1, 7, 9, 0, tzinfo=pytz.utc)
+        weekly = Event.objects.create(
+            title='Maths', start=start, end=start + datetime.timedelta(hours=1),
+            rule=Rule.objects.create(frequency='WEEKLY'), calendar=calendar)
+        lunch = Event.objects.create(title='Lunch', start=start + datetime.timedelta(hours=3),
+                             end=start + datetime.timedelta(hours=4), calendar=calendar)
+        daily = Event(
+            title='Assembly', start=start + datetime.timedelta(minutes=30), end=start + datetime.timedelta(hours=3, minutes=30),
+            rule=Rule.objects.create(frequency='DAILY'), calendar=calendar)
+        window = (start, start + datetime.timedelta(days=28))
+
+        conflicts = daily.get_conflicts(*window)
+        first = start + datetime.timedelta(minutes=30)
+        self.assertEqual([(c.start, o.start, o.event) for c, o in conflicts],
+                         [(first, start, weekly), (first, lunch.start, lunch)] +
+                         [(first + datetime.timedelta(days=days), start + datetime.timedelta(days=days), weekly)
+                          for days in (7, 14, 21)])
+
+        # the candidates are only checked against the rest of the calendar
+        conflicts = calendar.get_conflicts([daily, weekly], *window)
+        self.assertEqual([(c.event.title, o.event.title) for c, o in conflicts], [('Assembly', 'Lunch')])
+
 #    def test_get_absolute_url(self):
 #        calendar = Calendar()
 #        self.assertEquals(calendar.get_absolute_url(), '')
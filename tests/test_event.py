@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 import datetime
+import os
 from django.core.urlresolvers import reverse
 from django.test.utils import override_settings
 import pytz
@@ -10,6 +11,7 @@ from django.utils import timezone
 from django.contrib.auth.models import User
 
 from schedule.models import Event, Rule, Calendar, EventRelation
+from schedule.models.events import rrule_cache, flush_checkpoints, batch_checkpoints, CHECKPOINT_UPDATE_SIZE
 
 
 class TestEvent(TestCase):
@@ -441,6 +443,235 @@ class TestEvent(TestCase):
         url = event.get_absolute_url()
         self.assertEquals(reverse('event', kwargs={'event_id': event.id}), url)
 
+    def test_rrule_cache(self):
+        rrule_cache.clear()
+        rule = Rule.objects.create(frequency="WEEKLY")
+        cal = Calendar.objects.create(name='MyCal')
+        event = self.__create_recurring_event(
+                    'Recurrent event test rrule cache',
+                    datetime.datetime(2008, 1, 5, 8, 0, tzinfo=pytz.utc),
+                    datetime.datetime(2008, 1, 5, 9, 0, tzinfo=pytz.utc),
+                    datetime.datetime(2008, 5, 5, 0, 0, tzinfo=pytz.utc),
+                    rule,
+                    cal,
+                    )
+        self.assertTrue(event.get_rrule_object() is Event.objects.get(pk=event.pk).get_rrule_object())
+        self.assertEqual(rrule_cache.stats()['hits'], 1)
+
+        rule.params = "interval:2"
+        rule.save()
+        self.assertEqual(len(rrule_cache), 0)
+        occurrences = event.get_occurrences(datetime.datetime(2008, 1, 1, tzinfo=pytz.utc),
+                                            datetime.datetime(2008, 2, 1, tzinfo=pytz.utc))
+        self.assertEqual([o.start.day for o in occurrences], [5, 19])
+
+    def test_rrule_cache_does_not_grow(self):
+        rrule_cache.clear()
+        # not a fixed series, so walked by dateutil
+        rule = Rule.objects.create(frequency="MONTHLY", params="byweekday:MO,TU,WE,TH,FR")
+        cal = Calendar.objects.create(name='MyCal')
+        event = self.__create_recurring_event(
+                    'Recurrent event test rrule walk',
+                    datetime.datetime(2008, 1, 1, 8, 0, tzinfo=pytz.utc),
+                    datetime.datetime(2008, 1, 1, 9, 0, tzinfo=pytz.utc),
+                    None,
+                    rule,
+                    cal,
+                    )
+        for year in range(2010, 2030):
+            occurrences = event.get_occurrences(datetime.datetime(year, 1, 1, tzinfo=pytz.utc),
+                                                datetime.datetime(year, 2, 1, tzinfo=pytz.utc))
+            self.assertTrue(len(occurrences) >= 21)
+        self.assertEqual(len(rrule_cache), 1)
+        # dateutil keeps no dates on the cached rrule
+        self.assertFalse(event.get_rrule_object()._cache)
+
+    def test_checkpoint(self):
+        rule = Rule.objects.create(frequency="WEEKLY")
+        cal = Calendar.objects.create(name='MyCal')
+        event = self.__create_recurring_event(
+                    'Recurrent event test checkpoint',
+                    datetime.datetime(2008, 1, 5, 8, 0, tzinfo=pytz.utc),
+                    datetime.datetime(2008, 1, 5, 9, 0, tzinfo=pytz.utc),
+                    None,
+                    rule,
+                    cal,
+                    )
+        self.assertEqual(event.recent_occurrence_start, None)
+        occurrence = event.get_occurrences(datetime.datetime(2009, 1, 1, tzinfo=pytz.utc),
+                                           datetime.datetime(2009, 1, 8, tzinfo=pytz.utc))[0]
+        event.set_checkpoint(occurrence)
+        event.save()
+        event = Event.objects.get(pk=event.pk)
+        self.assertEqual(event.recent_occurrence_start, datetime.datetime(2009, 1, 3, 8, 0, tzinfo=pytz.utc))
+        self.assertEqual(event.get_optimized_rrule_object(datetime.datetime(2010, 1, 1, tzinfo=pytz.utc))._dtstart,
+                         datetime.datetime(2009, 1, 3, 8, 0, tzinfo=pytz.utc))
+        self.assertEqual(event.get_optimized_rrule_object(datetime.datetime(2008, 6, 1, tzinfo=pytz.utc))._dtstart,
+                         event.start)
+
+        event.start = datetime.datetime(2008, 1, 6, 8, 0, tzinfo=pytz.utc)
+        self.assertEqual(event.recent_occurrence_start, None)
+
+    def test_checkpoint_advanced_on_read(self):
+        os.environ['ENABLE_OPTIMIZED_RRULE_GENERATION'] = 'True'
+        self.addCleanup(os.environ.pop, 'ENABLE_OPTIMIZED_RRULE_GENERATION')
+        # plain weekly rules are computed without dateutil, see FixedSeries
+        rule = Rule.objects.create(frequency="WEEKLY", params="byweekday:SA")
+        cal = Calendar.objects.create(name='MyCal')
+        event = self.__create_recurring_event(
+                    'Recurrent event test checkpoint',
+                    datetime.datetime(2008, 1, 5, 8, 0, tzinfo=pytz.utc),
+                    datetime.datetime(2008, 1, 5, 9, 0, tzinfo=pytz.utc),
+                    None,
+                    rule,
+                    cal,
+                    )
+        other = self.__create_recurring_event(
+                    'Recurrent event test moved',
+                    datetime.datetime(2008, 1, 5, 8, 0, tzinfo=pytz.utc),
+                    datetime.datetime(2008, 1, 5, 9, 0, tzinfo=pytz.utc),
+                    None,
+                    rule,
+                    cal,
+                    )
+        # too close to dtstart to be worth a checkpoint
+        event.get_occurrences(datetime.datetime(2008, 1, 10, tzinfo=pytz.utc),
+                              datetime.datetime(2008, 1, 20, tzinfo=pytz.utc))
+        self.assertEqual(flush_checkpoints(), 0)
+
+        with batch_checkpoints():
+            for e in (event, other):
+                e.get_occurrences(datetime.datetime(2010, 1, 1, tzinfo=pytz.utc),
+                                  datetime.datetime(2010, 1, 8, tzinfo=pytz.utc))
+            # another writer moved this event in the meantime
+            Event.objects.filter(pk=other.pk).update(start=datetime.datetime(2008, 1, 6, 8, 0, tzinfo=pytz.utc))
+            with self.assertNumQueries(1):
+                self.assertEqual(flush_checkpoints(), 2)
+        self.assertEqual(Event.objects.get(pk=event.pk).recent_occurrence_start,
+                         datetime.datetime(2010, 1, 2, 8, 0, tzinfo=pytz.utc))
+        self.assertEqual(Event.objects.get(pk=other.pk).checkpoint_start, None)
+
+        # an older checkpoint never replaces a later one
+        event = Event.objects.get(pk=event.pk)
+        event.set_checkpoint(event._create_occurrence(datetime.datetime(2009, 1, 3, 8, 0, tzinfo=pytz.utc)))
+        event.save()
+        Event.objects.filter(pk=event.pk).update(checkpoint_start=datetime.datetime(2011, 1, 1, 8, 0, tzinfo=pytz.utc))
+        event.get_occurrences(datetime.datetime(2010, 6, 1, tzinfo=pytz.utc),
+                              datetime.datetime(2010, 6, 8, tzinfo=pytz.utc))
+        self.assertEqual(Event.objects.get(pk=event.pk).checkpoint_start,
+                         datetime.datetime(2011, 1, 1, 8, 0, tzinfo=pytz.utc))
+
+    def test_checkpoint_saved_outside_of_requests(self):
+        os.environ['ENABLE_OPTIMIZED_RRULE_GENERATION'] = 'True'
+        self.addCleanup(os.environ.pop, 'ENABLE_OPTIMIZED_RRULE_GENERATION')
+        rule = Rule.objects.create(frequency="WEEKLY", params="byweekday:SA")
+        cal = Calendar.objects.create(name='MyCal')
+        events = [self.__create_recurring_event(
+                      'Recurrent event test task %d' % i,
+                      datetime.datetime(2008, 1, 5, 8, 0, tzinfo=pytz.utc),
+                      datetime.datetime(2008, 1, 5, 9, 0, tzinfo=pytz.utc),
+                      None,
+                      rule,
+                      cal,
+                      ) for i in range(2)]
+        # as in a task or the shell, no request_finished follows
+        events[0].get_occurrences(datetime.datetime(2010, 1, 1, tzinfo=pytz.utc),
+                                  datetime.datetime(2010, 1, 8, tzinfo=pytz.utc))
+        self.assertEqual(Event.objects.get(pk=events[0].pk).recent_occurrence_start,
+                         datetime.datetime(2010, 1, 2, 8, 0, tzinfo=pytz.utc))
+        self.assertEqual(flush_checkpoints(), 0)
+
+        # expanding events together writes their checkpoints with one UPDATE
+        with self.assertNumQueries(1):
+            Event.objects.get_occurrences_for(events, datetime.datetime(2011, 1, 1, tzinfo=pytz.utc),
+                                              datetime.datetime(2011, 1, 8, tzinfo=pytz.utc),
+                                              persisted_occurrences=[])
+        for event in events:
+            self.assertEqual(Event.objects.get(pk=event.pk).recent_occurrence_start,
+                             datetime.datetime(2011, 1, 1, 8, 0, tzinfo=pytz.utc))
+
+    def test_checkpoints_flushed_in_chunks(self):
+        os.environ['ENABLE_OPTIMIZED_RRULE_GENERATION'] = 'True'
+        self.addCleanup(os.environ.pop, 'ENABLE_OPTIMIZED_RRULE_GENERATION')
+        rule = Rule.objects.create(frequency="WEEKLY", params="byweekday:SA")
+        cal = Calendar.objects.create(name='MyCal')
+        events = [self.__create_recurring_event(
+                      'Recurrent event test chunk %d' % i,
+                      datetime.datetime(2008, 1, 5, 8, 0, tzinfo=pytz.utc),
+                      datetime.datetime(2008, 1, 5, 9, 0, tzinfo=pytz.utc),
+                      None,
+                      rule,
+                      cal,
+                      ) for i in range(CHECKPOINT_UPDATE_SIZE + 1)]
+        # one UPDATE per CHECKPOINT_UPDATE_SIZE events keeps under SQLite's variable limit
+        with self.assertNumQueries(2):
+            Event.objects.get_occurrences_for(events, datetime.datetime(2010, 1, 1, tzinfo=pytz.utc),
+                                              datetime.datetime(2010, 1, 8, tzinfo=pytz.utc),
+                                              persisted_occurrences=[])
+        self.assertEqual(Event.objects.filter(checkpoint_start__isnull=False).count(), len(events))
+
+    def test_fixed_series_matches_rrule(self):
+        cal = Calendar.objects.create(name='MyCal')
+        window = (datetime.datetime(2013, 3, 9, 7, 30, tzinfo=pytz.utc),
+                  datetime.datetime(2013, 3, 30, 8, 0, tzinfo=pytz.utc))
+        for frequency, params in (("DAILY", ""), ("DAILY", "interval:3"),
+                                  ("WEEKLY", "interval:2"), ("HOURLY", "interval:5")):
+            rule = Rule.objects.create(frequency=frequency, params=params)
+            event = self.__create_recurring_event(
+                        'Recurrent event test fixed series',
+                        datetime.datetime(2008, 1, 5, 8, 0, tzinfo=pytz.utc),
+                        datetime.datetime(2008, 1, 5, 9, 0, tzinfo=pytz.utc),
+                        datetime.datetime(2013, 3, 25, 8, 0, tzinfo=pytz.utc),
+                        rule,
+                        cal,
+                        )
+            series = event.get_fixed_series()
+            self.assertTrue(series is not None)
+            rrule = event.get_rrule_object()
+            self.assertEqual(series.between(window[0], window[1], inc=True),
+                             rrule.between(window[0], window[1], inc=True))
+            self.assertEqual(series.between(window[0], window[1]), rrule.between(window[0], window[1]))
+            for dt in (event.start, window[0], window[1]):
+                self.assertEqual(series.after(dt, inc=True), rrule.after(dt, inc=True))
+                self.assertEqual(series.after(dt), rrule.after(dt))
+            after = event.occurrences_after(window[0])
+            self.assertEqual(next(after).start, rrule.after(window[0] - datetime.timedelta(hours=1)))
+
+    def test_fixed_series_fallback(self):
+        cal = Calendar.objects.create(name='MyCal')
+        start = datetime.datetime(2008, 1, 5, 8, 0, tzinfo=pytz.utc)
+        for frequency, params, start in (
+                ("MONTHLY", "", start),
+                ("WEEKLY", "byweekday:SA", start),
+                ("DAILY", "count:3", start),
+                ("DAILY", "", pytz.timezone('Europe/Paris').localize(datetime.datetime(2008, 1, 5, 8, 0)))):
+            rule = Rule.objects.create(frequency=frequency, params=params)
+            event = self.__create_recurring_event(
+                        'Recurrent event test fixed series fallback',
+                        start, start + datetime.timedelta(hours=1), None, rule, cal)
+            self.assertIsNone(event.get_fixed_series())
+
+    def test_in_window(self):
+        cal = Calendar.objects.create(name="MyCal")
+        weekly = Rule.objects.create(frequency="WEEKLY")
+        start = datetime.datetime(2008, 1, 5, 8, 0, tzinfo=pytz.utc)
+        window = (datetime.datetime(2008, 3, 1, tzinfo=pytz.utc), datetime.datetime(2008, 4, 1, tzinfo=pytz.utc))
+        for title, event_start, duration, end_recurring_period, rule in (
+                ('one off inside', datetime.datetime(2008, 3, 3, tzinfo=pytz.utc), 1, None, None),
+                ('one off before', start, 1, None, None),
+                ('one off across', datetime.datetime(2008, 2, 28, tzinfo=pytz.utc), 48, None, None),
+                ('one off after', datetime.datetime(2008, 4, 3, tzinfo=pytz.utc), 1, None, None),
+                ('forever', start, 1, None, weekly),
+                ('recurring until inside', start, 1, datetime.datetime(2008, 3, 10, tzinfo=pytz.utc), weekly),
+                ('recurring until before', start, 1, datetime.datetime(2008, 2, 10, tzinfo=pytz.utc), weekly),
+                ('recurring after', datetime.datetime(2008, 4, 3, tzinfo=pytz.utc), 1, None, weekly)):
+            self.__create_recurring_event(title, event_start, event_start + datetime.timedelta(hours=duration),
+                                          end_recurring_period, rule, cal)
+        self.assertEqual(sorted(e.title for e in cal.events.in_window(*window)),
+                         ['forever', 'one off across', 'one off inside', 'recurring until inside'])
+        for event in Event.objects.all():
+            self.assertEqual(event in cal.events.in_window(*window), bool(event.get_occurrences(*window)))
+
     def test_(self):
         pass
 
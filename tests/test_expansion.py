@@ -0,0 +1,111 @@
+from __future__ import absolute_import
+import datetime
+import itertools
+import unittest
+import pytz
+
+from django.test import TestCase
+
+from schedule import expansion
+from schedule.models import Event, Rule, Calendar
+from schedule.models.events import rrule_cache
+from schedule.periods import Month
+
+
+class TestExpansion(TestCase):
+
+    def setUp(self):
+        cal = Calendar.objects.create(name="MyCal")
+        start = datetime.datetime(2008, 1, 5, 8, 0, tzinfo=pytz.utc)
+        for frequency, params, end_recurring_period in (
+                ("DAILY", "interval:3", None),
+                ("WEEKLY", "", datetime.datetime(2013, 3, 16, 8, 0, tzinfo=pytz.utc)),
+                ("HOURLY", "interval:7", None),
+                ("MONTHLY", "", None)):
+            Event.objects.create(
+                title='%s %s' % (frequency, params),
+                start=start,
+                end=start + datetime.timedelta(hours=2),
+                end_recurring_period=end_recurring_period,
+                rule=Rule.objects.create(frequency=frequency, params=params),
+                calendar=cal,
+            )
+        self.start = datetime.datetime(2013, 3, 1, tzinfo=pytz.utc)
+        self.end = datetime.datetime(2013, 4, 1, tzinfo=pytz.utc)
+
+        event = Event.objects.get(rule__frequency="DAILY")
+        moved, cancelled = event.get_occurrences(self.start, self.end)[1:3]
+        moved.move(moved.start + datetime.timedelta(hours=1), moved.end + datetime.timedelta(hours=1))
+        cancelled.cancel()
+
+    def expand(self, engine):
+        occurrences = expansion.expand_occurrences(Event.objects.all(), self.start, self.end, engine)
+        return sorted((o.event_id, o.start, o.end, o.pk, o.cancelled) for o in occurrences)
+
+    @unittest.skipIf(expansion.numpy is None, "numpy is not installed")
+    def test_numpy_matches_dateutil(self):
+        occurrences = self.expand('numpy')
+        self.assertEqual(occurrences, self.expand('dateutil'))
+        self.assertEqual(len([o for o in occurrences if o[3] is not None]), 2)
+
+    @unittest.skipIf(expansion.numpy is None, "numpy is not installed")
+    def test_period_engine(self):
+        month = Month(Event.objects.all(), self.start, engine='numpy')
+        self.assertEqual([(o.start, o.end) for o in month.occurrences],
+                         [(o.start, o.end) for o in Month(Event.objects.all(), self.start).occurrences])
+
+    def test_iter_occurrences(self):
+        occurrences = list(expansion.iter_occurrences(Event.objects.all(), self.start, self.end))
+        self.assertEqual(sorted((o.event_id, o.start, o.end, o.pk, o.cancelled) for o in occurrences),
+                         self.expand('dateutil'))
+        self.assertEqual([(o.start, o.end) for o in occurrences],
+                         sorted((o.start, o.end) for o in occurrences))
+
+        month = Month(Event.objects.all(), self.start)
+        self.assertEqual(list(month.iter_occurrences()), occurrences)
+        month.occurrences
+        self.assertEqual(list(month.iter_occurrences()), occurrences)
+
+    def test_iter_occurrences_is_lazy(self):
+        # a century of occurrences every 7 hours, of which only the first is built
+        events = Event.objects.filter(rule__frequency="HOURLY")
+        end = datetime.datetime(2113, 3, 1, tzinfo=pytz.utc)
+        first = next(expansion.iter_occurrences(events, self.start, end))
+        self.assertEqual(first.start, min(o.start for o in expansion.expand_occurrences(events, self.start, self.end)))
+
+    def test_iter_occurrences_memory_bounded(self):
+        # monthly rules are walked by dateutil, a century away from dtstart
+        rrule_cache.clear()
+        event = Event.objects.get(rule__frequency="MONTHLY")
+        start = datetime.datetime(2113, 3, 1, tzinfo=pytz.utc)
+        end = datetime.datetime(2113, 9, 1, tzinfo=pytz.utc)
+        for i in range(3):
+            occurrences = list(expansion.iter_occurrences([event], start, end))
+        self.assertEqual([(o.start, o.end) for o in occurrences],
+                         [(o.start, o.end) for o in event.get_occurrences(start, end)])
+        # the shared rrule keeps none of the dates walked to reach the window
+        self.assertEqual(len(rrule_cache), 1)
+        self.assertFalse(event.get_optimized_rrule_object(start)._cache)
+
+    def test_iter_occurrences_after(self):
+        def key(o):
+            return o.start, o.event_id, o.original_start, o.end, o.pk, o.cancelled
+        expected = sorted(key(o) for o in expansion.expand_occurrences(Event.objects.all(), self.start, self.end)
+                          if o.end > self.start)
+        # resume a fresh iterator from the cursor of every tenth occurrence
+        occurrences, cursor = [], None
+        while not occurrences or occurrences[-1].start <= self.end:
+            page = list(itertools.islice(
+                expansion.iter_occurrences_after(Event.objects.all(), self.start, cursor), 10))
+            occurrences += page
+            cursor = expansion.get_occurrence_cursor(page[-1])
+        self.assertEqual([key(o) for o in occurrences if o.start <= self.end], expected)
+
+    def test_get_engine(self):
+        self.assertEqual(expansion.get_engine('dateutil'), 'dateutil')
+        self.assertRaises(ValueError, expansion.get_engine, 'pandas')
+        numpy, expansion.numpy = expansion.numpy, None
+        try:
+            self.assertEqual(expansion.get_engine('numpy'), 'dateutil')
+        finally:
+            expansion.numpy = numpy
@@ -2,10 +2,13 @@ from __future__ import absolute_import
 import datetime
 import pytz
 
+from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from schedule.models import Event, Rule, Calendar
-from schedule.models.events import Occurrence
+from schedule.models.events import Occurrence, TransientOccurrence, APPLY_CHANGES_BATCH_SIZE
 from schedule.periods import Period
 
 
@@ -73,6 +76,108 @@ class TestOccurrence(TestCase):
         occurrences = self.recurring_event.get_occurrences(start=self.start, end=self.end)
         self.assertFalse(occurrences[2].cancelled)
 
+    def test_in_window(self):
+        occurrences = self.recurring_event.get_occurrences(
+            start=datetime.datetime(2008, 1, 1, tzinfo=pytz.utc),
+            end=datetime.datetime(2008, 5, 5, tzinfo=pytz.utc))
+        far, moved_out, moved_in = occurrences[-1], occurrences[2], occurrences[8]
+        far.cancel()
+        moved_out.move(moved_out.start + datetime.timedelta(days=60), moved_out.end + datetime.timedelta(days=60))
+        moved_in.move(moved_in.start - datetime.timedelta(days=42), moved_in.end - datetime.timedelta(days=42))
+        self.assertEqual(set(o.pk for o in self.recurring_event.occurrence_set.in_window(self.start, self.end)),
+                         set([moved_out.pk, moved_in.pk]))
+        self.assertEqual(list(Occurrence.objects.in_window(datetime.datetime(2008, 3, 10, tzinfo=pytz.utc))),
+                         [far, moved_out])
+        occurrences = self.recurring_event.get_occurrences(start=self.start, end=self.end)
+        self.assertEqual([o.start.day for o in occurrences], [12, 26, 19])
+        self.assertEqual(occurrences[2], moved_in)
+
+    def test_transient_occurrence(self):
+        occurrence = self.recurring_event.get_occurrences(start=self.start, end=self.end)[0]
+        self.assertTrue(isinstance(occurrence, TransientOccurrence))
+        self.assertFalse(hasattr(occurrence, '__dict__'))
+        self.assertEqual((occurrence.pk, occurrence.title, occurrence.cancelled, occurrence.moved),
+                         (None, 'Recent Event', False, False))
+        self.assertEqual(occurrence.get_absolute_url(), reverse('occurrence_by_date', kwargs={
+            'event_id': self.recurring_event.pk, 'year': 2008, 'month': 1, 'day': 12,
+            'hour': 8, 'minute': 0, 'second': 0}))
+
+        occurrence.cancel()
+        self.assertTrue(occurrence.pk is not None)
+        self.assertEqual(occurrence.get_absolute_url(), reverse('occurrence', kwargs={
+            'event_id': self.recurring_event.pk, 'occurrence_id': occurrence.pk}))
+        persisted = Occurrence.objects.get(pk=occurrence.pk)
+        self.assertTrue(persisted.cancelled)
+        self.assertEqual(persisted, occurrence)
+        self.assertEqual(self.recurring_event.get_occurrences(start=self.start, end=self.end)[0].pk,
+                         occurrence.pk)
+
+    def test_transient_occurrence_setters(self):
+        occurrences = self.recurring_event.get_occurrences(start=self.start, end=self.end)
+        occurrences[0].cancelled = True
+        occurrences[0].save()
+        self.assertTrue(Occurrence.objects.get(pk=occurrences[0].pk).cancelled)
+
+        occurrences[1].title = 'Renamed'
+        occurrences[1].description = 'Moved by an hour'
+        self.assertEqual(occurrences[1].title, 'Renamed')
+        occurrences[1].save()
+        persisted = Occurrence.objects.get(pk=occurrences[1].pk)
+        self.assertEqual((persisted.title, persisted.description), ('Renamed', 'Moved by an hour'))
+
+        # start and end are copied on every save, also after promotion
+        occurrences[1].start += datetime.timedelta(hours=1)
+        occurrences[1].end += datetime.timedelta(hours=1)
+        occurrences[1].save()
+        persisted = Occurrence.objects.get(pk=occurrences[1].pk)
+        self.assertEqual((persisted.start, persisted.end),
+                         (datetime.datetime(2008, 1, 19, 9, 0, tzinfo=pytz.utc),
+                          datetime.datetime(2008, 1, 19, 10, 0, tzinfo=pytz.utc)))
+        self.assertTrue(persisted.moved)
+
+    def test_apply_changes(self):
+        occurrences = self.recurring_event.get_occurrences(start=self.start, end=self.end)
+        occurrences[0].cancel()
+        hour = datetime.timedelta(hours=1)
+        changes = [
+            (self.recurring_event, occurrences[0].original_start, 'uncancel', None, None),
+            (self.recurring_event, occurrences[1].original_start, 'cancel', None, None),
+            (self.recurring_event, occurrences[2].original_start, 'move',
+             occurrences[2].start + hour, occurrences[2].end + hour),
+            (self.recurring_event, occurrences[2].original_start, 'cancel', None, None),
+        ]
+        # the persisted occurrences, one insert, its primary keys and one update within a savepoint
+        with self.assertNumQueries(6):
+            changed = Occurrence.objects.apply_changes(changes)
+        self.assertEqual([o.original_start for o in changed], [o.original_start for o in occurrences])
+        self.assertEqual(Occurrence.objects.filter(pk__in=[o.pk for o in changed]).count(), 3)
+
+        occurrences = self.recurring_event.get_occurrences(start=self.start, end=self.end)
+        self.assertEqual([(o.cancelled, o.moved) for o in occurrences], [(False, False), (True, False), (True, True)])
+        self.assertEqual(occurrences[2].start, datetime.datetime(2008, 1, 26, 9, 0, tzinfo=pytz.utc))
+
+        self.assertRaises(ValueError, Occurrence.objects.apply_changes, [
+            (self.recurring_event, occurrences[0].original_start, 'move', self.start, self.end),
+            (self.recurring_event, occurrences[0].original_start + hour, 'cancel', None, None),
+        ])
+        self.assertFalse(Occurrence.objects.get(original_start=occurrences[0].original_start).moved)
+
+    def test_apply_changes_in_batches(self):
+        rule = Rule.objects.create(frequency="DAILY")
+        event = Event.objects.create(title='Daily Event', start=self.start, end=self.start + datetime.timedelta(hours=1),
+                                     rule=rule, calendar=self.recurring_event.calendar)
+        count = APPLY_CHANGES_BATCH_SIZE + 50
+        starts = [self.start + datetime.timedelta(days=day) for day in range(count)]
+        changed = Occurrence.objects.apply_changes([(event, start, 'cancel', None, None) for start in starts])
+        self.assertEqual(len(set(o.pk for o in changed if o.pk is not None)), count)
+
+        # one UPDATE per batch keeps under SQLite's variable limit
+        with CaptureQueriesContext(connection) as queries:
+            changed = Occurrence.objects.apply_changes([(event, start, 'uncancel', None, None) for start in starts])
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(Occurrence.objects.filter(event=event, cancelled=False).count(), count)
+
     def test_occurrence_eq_method(self):
         event2 = Event.objects.create(**self.recurring_data)
         self.assertEqual(self.recurring_event.get_occurrences(start=self.start, end=self.end)[0],
@@ -0,0 +1,120 @@
+from __future__ import absolute_import
+import datetime
+import pytz
+
+from django.test import TestCase
+from django.utils import timezone
+
+from schedule.conf import settings
+from schedule.models import Event, Rule, Calendar, OccurrenceIndex
+from schedule.periods import Period
+
+
+class TestOccurrenceIndex(TestCase):
+
+    def setUp(self):
+        self._use_index = settings.USE_OCCURRENCE_INDEX
+        settings.USE_OCCURRENCE_INDEX = True
+        self.rule = Rule.objects.create(frequency="WEEKLY")
+        self.cal = Calendar.objects.create(name="MyCal")
+        start = timezone.now().replace(hour=8, minute=0, second=0, microsecond=0, tzinfo=pytz.utc)
+        self.event = Event.objects.create(
+            title='Weekly Event',
+            start=start,
+            end=start + datetime.timedelta(hours=1),
+            end_recurring_period=start + datetime.timedelta(days=60),
+            rule=self.rule,
+            calendar=self.cal,
+        )
+        OccurrenceIndex.objects.rebuild_for_event(self.event)
+        self.start = start - datetime.timedelta(days=1)
+        self.end = start + datetime.timedelta(days=20)
+
+    def tearDown(self):
+        settings.USE_OCCURRENCE_INDEX = self._use_index
+
+    def test_rows_created_on_rebuild(self):
+        self.assertEqual(OccurrenceIndex.objects.filter(event=self.event).count(), 9)
+        self.assertTrue(Event.objects.get(pk=self.event.pk).indexed_until is not None)
+
+    def test_event_save_invalidates_event(self):
+        self.event.title = 'Renamed Event'
+        # the event and its indexed range
+        with self.assertNumQueries(2):
+            self.event.save()
+        self.assertIsNone(self.event.indexed_until)
+        self.assertIsNone(Event.objects.get(pk=self.event.pk).indexed_until)
+        self.assertEqual(OccurrenceIndex.objects.filter(event=self.event).count(), 9)
+
+    def test_index_matches_expansion(self):
+        events = Event.objects.filter(pk=self.event.pk)
+        indexed = OccurrenceIndex.objects.get_occurrences(events, self.start, self.end)
+        expanded = self.event.get_occurrences(self.start, self.end)
+        self.assertEqual([(o.start, o.end) for o in sorted(indexed)],
+                         [(o.start, o.end) for o in expanded])
+
+    def test_window_outside_horizon(self):
+        events = Event.objects.filter(pk=self.event.pk)
+        far = self.start + datetime.timedelta(days=5 * 365)
+        self.assertIsNone(OccurrenceIndex.objects.get_occurrences(
+            events, far, far + datetime.timedelta(days=7)))
+
+    def test_persisted_occurrence_updates_index(self):
+        occurrence = self.event.get_occurrences(self.start, self.end)[1]
+        occurrence.move(occurrence.start + datetime.timedelta(hours=2),
+                        occurrence.end + datetime.timedelta(hours=2))
+        row = OccurrenceIndex.objects.get(event=self.event, original_start=occurrence.original_start)
+        self.assertEqual(row.occurrence_id, occurrence.pk)
+        self.assertEqual(row.start, occurrence.start)
+
+        period = Period(Event.objects.all(), self.start, self.end)
+        self.assertTrue(occurrence.pk in [o.pk for o in period.occurrences])
+
+    def test_persisted_occurrence_keeps_other_rows(self):
+        occurrence = self.event.get_occurrences(self.start, self.end)[1]
+        others = set(OccurrenceIndex.objects.filter(event=self.event).exclude(
+            original_start=occurrence.original_start).values_list('pk', flat=True))
+        # the occurrence, the indexed range and its row replaced
+        with self.assertNumQueries(4):
+            occurrence.cancel()
+        row = OccurrenceIndex.objects.get(event=self.event, original_start=occurrence.original_start)
+        self.assertTrue(row.cancelled)
+        self.assertEqual(set(OccurrenceIndex.objects.filter(event=self.event).values_list('pk', flat=True)),
+                         others | set([row.pk]))
+
+    def test_cancelled_occurrence_moved_into_window(self):
+        occurrence = self.event.get_occurrences(self.start, self.end)[2]
+        occurrence.move(occurrence.start - datetime.timedelta(days=10),
+                        occurrence.end - datetime.timedelta(days=10))
+        occurrence.cancel()
+        # its slot is outside of the window, but inside of the horizon
+        start = occurrence.start - datetime.timedelta(hours=1)
+        end = occurrence.original_start - datetime.timedelta(days=1)
+        events = Event.objects.filter(pk=self.event.pk)
+        indexed = OccurrenceIndex.objects.get_occurrences(events, start, end)
+        expanded = self.event.get_occurrences(start, end)
+        self.assertEqual([(o.start, o.end, o.cancelled) for o in sorted(indexed)],
+                         [(o.start, o.end, o.cancelled) for o in expanded])
+        self.assertFalse(occurrence.pk in [o.pk for o in indexed])
+
+        # still shown where expansion shows its slot
+        indexed = OccurrenceIndex.objects.get_occurrences(events, start, self.end)
+        self.assertTrue(occurrence.pk in [o.pk for o in indexed])
+
+    def test_rule_change_invalidates_events(self):
+        self.rule.params = 'interval:2'
+        self.rule.save()
+        event = Event.objects.get(pk=self.event.pk)
+        self.assertIsNone(event.indexed_until)
+        self.assertEqual(OccurrenceIndex.objects.get_occurrences([event], self.start, self.end), None)
+
+    def test_deleted_occurrence_invalidates_event(self):
+        occurrence = self.event.get_occurrences(self.start, self.end)[0]
+        occurrence.save()
+        occurrence.delete()
+        self.assertIsNone(Event.objects.get(pk=self.event.pk).indexed_until)
+
+    def test_period_uses_single_query(self):
+        period = Period(list(Event.objects.all()), self.start, self.end)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(period.occurrences), 3)
@@ -2,11 +2,14 @@ from __future__ import absolute_import
 import datetime
 import pytz
 
+from django.core.cache import caches
+from django.core.urlresolvers import reverse
 from django.test import TestCase
 
+from schedule.conf import settings
 from schedule.conf.settings import FIRST_DAY_OF_WEEK
 from schedule.models import Event, Rule, Calendar
-from schedule.periods import Period, Month, Day, Year, Week
+from schedule.periods import Period, Month, Day, Year, Week, get_day_boundaries, day_boundary_cache
 from six.moves import range
 from six.moves import zip
 
@@ -38,6 +41,26 @@ class TestPeriod(TestCase):
                     '2008-01-12 08:00:00+00:00 to 2008-01-12 09:00:00+00:00',
                     '2008-01-19 08:00:00+00:00 to 2008-01-19 09:00:00+00:00'])
 
+    def test_for_calendars(self):
+        calendars = [Calendar.objects.create(name="Cal %s" % i) for i in range(3)]
+        start = datetime.datetime(2008, 1, 10, 8, 0, tzinfo=pytz.utc)
+        for cal in calendars:
+            Event.objects.create(title=cal.name, start=start, end=start + datetime.timedelta(hours=1), calendar=cal)
+        month = Month.for_calendars(calendars, start)
+        # one query for the events and one for their persisted occurrences
+        with self.assertNumQueries(2):
+            occurrences = [o for week in month.get_weeks() for day in week.get_days()
+                           for o in day.get_occurrences()]
+            self.assertEqual(sorted((o.title, o.calendar.name) for o in occurrences),
+                             [("Cal 0", "Cal 0"), ("Cal 1", "Cal 1"), ("Cal 2", "Cal 2")])
+
+    def test_get_busy_ranges(self):
+        start = datetime.datetime(2008, 1, 5, 8, 30, tzinfo=pytz.utc)
+        Event.objects.create(title='Overlapping', start=start, end=start + datetime.timedelta(hours=1),
+                             calendar=Calendar.objects.get(name="MyCal"))
+        self.assertEqual([(s.day, s.hour, s.minute, e.day, e.hour, e.minute) for s, e in self.period.get_busy_ranges()],
+                         [(5, 8, 0, 5, 9, 30), (12, 8, 0, 12, 9, 0), (19, 8, 0, 19, 9, 0)])
+
     def test_get_occurrence_partials(self):
         occurrence_dicts = self.period.get_occurrence_partials()
         self.assertEqual(
@@ -57,6 +80,50 @@ class TestPeriod(TestCase):
                  datetime.datetime(2008, 1, 19, 9, 0, tzinfo=pytz.utc))
             ])
 
+    def test_persisted_occurrences_single_query(self):
+        event = Event.objects.get()
+        for days in (1, 2):
+            event.pk = None
+            event.start += datetime.timedelta(days=1)
+            event.end += datetime.timedelta(days=1)
+            event.save()
+        occurrence = event.get_occurrences(self.period.start, self.period.end)[0]
+        occurrence.move(occurrence.start, occurrence.end + datetime.timedelta(hours=1))
+        period = Period(list(Event.objects.select_related('rule')), self.period.start, self.period.end)
+        with self.assertNumQueries(1):
+            occurrences = period.occurrences
+        self.assertEqual(len(occurrences), 8)
+        self.assertEqual([o.pk for o in occurrences if o.pk], [occurrence.pk])
+
+    def test_month_persisted_occurrences_single_query(self):
+        event = Event.objects.get()
+        occurrence = event.get_occurrences(self.period.start, self.period.end)[1]
+        occurrence.cancel()
+        event.get_occurrences(datetime.datetime(2008, 4, 1, tzinfo=pytz.utc),
+                              datetime.datetime(2008, 4, 8, tzinfo=pytz.utc))[0].cancel()
+        month = Month(list(Event.objects.select_related('rule')), datetime.datetime(2008, 1, 1, tzinfo=pytz.utc))
+        with self.assertNumQueries(1):
+            for week in month.get_weeks():
+                for day in week.get_days():
+                    day.get_occurrences()
+                    day.get_time_slot(day.start, day.end).get_occurrences()
+        self.assertEqual([o.pk for o in month.get_persisted_occurrences()], [occurrence.pk])
+        self.assertEqual([o.cancelled for o in month.get_day(12).get_occurrences()], [True])
+
+    def test_month_view_queries(self):
+        calendar = Calendar.objects.get(name="MyCal")
+        calendar.slug = 'mycal'
+        calendar.save()
+        event = Event.objects.get()
+        event.get_occurrences(self.period.start, self.period.end)[1].cancel()
+        url = reverse('month_calendar', kwargs={'calendar_slug': calendar.slug})
+        # the validators, the calendar, the events with their rule and the
+        # persisted occurrences of the month, never the whole history
+        with self.assertNumQueries(6):
+            response = self.client.get(url, {'year': 2008, 'month': 1})
+        self.assertEqual([o.cancelled for o in response.context['periods']['month'].get_occurrences()],
+                         [False, True, False, False])
+
     def test_has_occurrence(self):
         self.assert_( self.period.has_occurrences() )
         slot = self.period.get_time_slot( datetime.datetime(2008, 1, 4, 7, 0, tzinfo=pytz.utc),
@@ -254,6 +321,154 @@ class TestOccurrencePool(TestCase):
         period = Period(parent_period.events, start, end, parent_period.get_persisted_occurrences(), parent_period.occurrences)
         self.assertEquals(parent_period.occurrences, period.occurrences)
 
+    def test_pool_slices(self):
+        Event.objects.create(
+            title='Long Event',
+            start=datetime.datetime(2008, 1, 2, 12, 0, tzinfo=pytz.utc),
+            end=datetime.datetime(2008, 1, 16, 12, 0, tzinfo=pytz.utc),
+            calendar=self.recurring_event.calendar,
+        )
+        month = Month(Event.objects.all(), datetime.datetime(2008, 1, 1, tzinfo=pytz.utc))
+        pool = month.get_occurrence_pool()
+        self.assertEqual(pool.max_duration, datetime.timedelta(days=14))
+        self.assertTrue(month.get_occurrence_pool() is pool)
+        for day in month.get_days():
+            self.assertTrue(day.occurrence_pool is pool)
+            direct = Day(Event.objects.all(), day.start)
+            self.assertEqual([(o.start, o.end) for o in day.occurrences],
+                             [(o.start, o.end) for o in direct.occurrences])
+        day = month.get_day(12)
+        self.assertEqual(sorted(o.title for o in day.occurrences), ['Long Event', 'Recent Event'])
+
+
+class TestDayBuckets(TestCase):
+
+    def setUp(self):
+        cal = Calendar.objects.create(name="MyCal")
+        rule = Rule.objects.create(frequency="DAILY", params="interval:2")
+        Event.objects.create(
+            title='Every other day',
+            start=datetime.datetime(2008, 2, 20, 22, 0, tzinfo=pytz.utc),
+            end=datetime.datetime(2008, 2, 21, 9, 0, tzinfo=pytz.utc),
+            rule=rule,
+            calendar=cal,
+        )
+        Event.objects.create(
+            title='Long Event',
+            start=datetime.datetime(2008, 3, 5, 12, 0, tzinfo=pytz.utc),
+            end=datetime.datetime(2008, 3, 12, 5, 0, tzinfo=pytz.utc),
+            calendar=cal,
+        )
+        self.tzinfo = pytz.timezone('America/Chicago')
+
+    def partials(self, day):
+        return [(p['occurrence'].start, p['class']) for p in day.get_occurrence_partials()]
+
+    def test_buckets_match_days(self):
+        month = Month(Event.objects.all(), datetime.datetime(2008, 3, 1), tzinfo=self.tzinfo)
+        buckets = month.get_day_buckets()
+        # March 2008 has 31 days of which one is 23 hours long
+        self.assertEqual(len(buckets), 31)
+        for week in month.get_weeks():
+            for day in week.get_days():
+                if day.start.month != 3:
+                    continue
+                fresh = Day(Event.objects.all(), day.start, tzinfo=self.tzinfo)
+                self.assertEqual(self.partials(day), self.partials(fresh))
+                self.assertEqual(day.has_occurrences(), fresh.has_occurrences())
+        self.assertEqual(sorted(c for start, c in self.partials(month.get_day(8))), [2, 3])
+        self.assertEqual(sorted(c for start, c in self.partials(month.get_day(11))), [0, 2])
+
+    def test_year_buckets_shared(self):
+        year = Year(Event.objects.all(), datetime.datetime(2008, 1, 1, tzinfo=pytz.utc))
+        months = list(year.get_months())
+        self.assertEqual(len(year.day_buckets), 366)
+        self.assertTrue(all(month.day_buckets is year.day_buckets for month in months))
+
+
+class TestDayBoundaries(TestCase):
+
+    def test_dst_boundaries(self):
+        tzinfo = pytz.timezone('America/Chicago')
+        day_boundary_cache.clear()
+        boundaries = get_day_boundaries(tzinfo, datetime.date(2008, 3, 8), datetime.date(2008, 3, 10))
+        self.assertEqual(boundaries, [
+            datetime.datetime(2008, 3, 8, 6, 0, tzinfo=pytz.utc),
+            datetime.datetime(2008, 3, 9, 6, 0, tzinfo=pytz.utc),
+            datetime.datetime(2008, 3, 10, 5, 0, tzinfo=pytz.utc),
+        ])
+        self.assertEqual(day_boundary_cache.stats()['misses'], 3)
+
+        day = Day([], datetime.datetime(2008, 3, 9), tzinfo=tzinfo)
+        self.assertEqual((day.utc_start, day.utc_end), tuple(boundaries[1:]))
+        self.assertEqual(day_boundary_cache.stats()['hits'], 2)
+        self.assertTrue(day.start is day.start)
+
+    def test_get_periods(self):
+        month = Month([], datetime.datetime(2008, 3, 1), tzinfo=pytz.timezone('America/Chicago'))
+        days = list(month.get_days())
+        self.assertEqual([d.start.day for d in days], list(range(1, 32)))
+        self.assertEqual([d.end for d in days[:-1]], [d.start for d in days[1:]])
+
+
+class TestPeriodCache(TestCase):
+
+    def setUp(self):
+        self._period_cache = settings.PERIOD_CACHE
+        settings.PERIOD_CACHE = 'default'
+        caches['default'].clear()
+        self.cal = Calendar.objects.create(name="MyCal")
+        start = datetime.datetime(2008, 1, 5, 8, 0, tzinfo=pytz.utc)
+        self.rule = Rule.objects.create(frequency="WEEKLY")
+        self.event = Event.objects.create(
+            title='Recent Event',
+            start=start,
+            end=start + datetime.timedelta(hours=1),
+            end_recurring_period=datetime.datetime(2008, 5, 5, 0, 0, tzinfo=pytz.utc),
+            rule=self.rule,
+            calendar=self.cal,
+        )
+        self.start = datetime.datetime(2008, 1, 4, 7, 0, tzinfo=pytz.utc)
+        self.end = datetime.datetime(2008, 1, 21, 7, 0, tzinfo=pytz.utc)
+
+    def tearDown(self):
+        settings.PERIOD_CACHE = self._period_cache
+
+    def occurrences(self):
+        period = Period(list(Event.objects.all()), self.start, self.end)
+        return [(o.start, o.end, o.pk, o.cancelled) for o in period.occurrences]
+
+    def test_cached_across_periods(self):
+        expected = self.occurrences()
+        self.assertEqual(len(expected), 3)
+        events = list(Event.objects.all())
+        with self.assertNumQueries(0):
+            period = Period(events, self.start, self.end)
+            self.assertEqual([(o.start, o.end, o.pk, o.cancelled) for o in period.occurrences], expected)
+        self.assertTrue(all(o.event is events[0] for o in period.occurrences))
+
+    def test_invalidated_by_changes(self):
+        self.occurrences()
+        occurrence = self.event.get_occurrences(self.start, self.end)[1]
+        occurrence.cancel()
+        occurrences = self.occurrences()
+        self.assertEqual([o[2:] for o in occurrences], [(None, False), (occurrence.pk, True), (None, False)])
+        # persisted occurrences come back from the cache as well
+        self.assertEqual(self.occurrences(), occurrences)
+
+        self.rule.params = "interval:2"
+        self.rule.save()
+        self.assertEqual(len(self.occurrences()), 2)
+
+    def test_given_persisted_occurrences_not_cached(self):
+        expected = self.occurrences()
+        events = list(Event.objects.all())
+        occurrence = self.event.get_occurrences(self.start, self.end)[1].promote()
+        occurrence.cancelled = True
+        period = Period(events, self.start, self.end, parent_persisted_occurrences=[occurrence])
+        self.assertEqual([o.cancelled for o in period.occurrences], [False, True, False])
+        self.assertEqual(self.occurrences(), expected)
+
 
 class TestAwareDay(TestCase):
     def setUp(self):
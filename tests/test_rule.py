@@ -1,10 +1,14 @@
 from __future__ import absolute_import
 import datetime
+import json
 import pytz
 
+from dateutil.rrule import MO, TU, FR
+from django.core.exceptions import ValidationError
 from django.test import TestCase
 
-from schedule.models import Rule
+from schedule.models import Calendar, Event, Rule
+from schedule.models.rules import parse_params
 
 class TestPeriod(TestCase):
 
@@ -15,3 +19,41 @@ class TestPeriod(TestCase):
         rule = Rule(params = "count:1;bysecond:1;byminute:1,2,4,5")
         expected =  {'count': 1, 'byminute': [1, 2, 4, 5], 'bysecond': 1}
         self.assertEquals(rule.get_params(), expected)
+
+    def test_get_params_weekdays(self):
+        rule = Rule(params="byweekday:MO,TU;wkst:MO;bysetpos:-1")
+        self.assertEquals(rule.get_params(), {'byweekday': [MO, TU], 'wkst': MO, 'bysetpos': -1})
+        rule = Rule(params="byweekday:FR(-1)")
+        self.assertEquals(rule.get_params(), {'byweekday': FR(-1)})
+
+    def test_parse_params_invalid(self):
+        self.assertRaises(ValidationError, parse_params, "bogus:1")
+        self.assertRaises(ValidationError, parse_params, "byhour:noon")
+        self.assertRaises(ValidationError, parse_params, "tzid:Nowhere/Special")
+        self.assertRaises(ValidationError, Rule(frequency="WEEKLY", params="byweekday:XX").save)
+
+    def test_parsed_params_saved(self):
+        rule = Rule.objects.create(frequency="WEEKLY", params="byweekday:MO,2TU;interval:2")
+        rule = Rule.objects.get(pk=rule.pk)
+        self.assertEquals(json.loads(rule.parsed_params), {'byweekday': [[0, None], [1, 2]], 'interval': 2})
+        self.assertEquals(rule.get_params(), {'byweekday': [MO, TU(+2)], 'interval': 2})
+
+        rule.params = "interval:3"
+        self.assertEquals(rule.get_params(), {'interval': 3})
+
+    def test_get_params_tzid(self):
+        rule = Rule(params="tzid:US/Pacific")
+        self.assertEquals(rule.get_params(), {'tzid': pytz.timezone('US/Pacific')})
+
+    def test_legacy_params_parsed_leniently(self):
+        rule = Rule.objects.create(frequency="WEEKLY")
+        # as left by migration 0004 for params it could not parse
+        Rule.objects.filter(pk=rule.pk).update(params="interval:2;byhour:noon;bogus:1", parsed_params=None)
+        rule = Rule.objects.get(pk=rule.pk)
+        self.assertEquals(rule.get_params(), {'interval': 2})
+
+        start = datetime.datetime(2008, 1, 5, 8, 0, tzinfo=pytz.utc)
+        event = Event.objects.create(title='Legacy', start=start, end=start + datetime.timedelta(hours=1),
+                                     rule=rule, calendar=Calendar.objects.create(name='MyCal'))
+        occurrences = event.get_occurrences(start, start + datetime.timedelta(days=27))
+        self.assertEquals([o.start.day for o in occurrences], [5, 19])
@@ -7,7 +7,8 @@ from django.utils.html import escape
 from schedule.models import Event, Rule, Calendar
 from schedule.periods import Period, Day
 
-from schedule.templatetags.scheduletags import querystring_for_date, prev_url, next_url, create_event_url
+from schedule.templatetags.scheduletags import querystring_for_date, prev_url, next_url, create_event_url, \
+    _cook_occurrences
 
 class TestTemplateTags(TestCase):
     def setUp(self):
@@ -58,3 +59,10 @@ class TestTemplateTags(TestCase):
                     "&minute=0&second=0")
         self.assertEqual(query_string['create_event_url'], escape(expected))
 
+    def test_cook_occurrences(self):
+        day = Day(events=Event.objects.all(), date=datetime.datetime(2008, 1, 12, tzinfo=pytz.utc))
+        day = day.get_time_slot(day.start + datetime.timedelta(hours=6), day.start + datetime.timedelta(hours=18))
+        occurrences = _cook_occurrences(day, day.get_occurrences(), 300, 480)
+        self.assertEqual([(o.title, o.cls, o.level, o.width, o.top, o.height) for o in occurrences],
+                         [('Recent Event', 1, 0, 298, 80, 40)])
+        self.assertEqual(occurrences[0].get_absolute_url(), day.get_occurrences()[0].get_absolute_url())
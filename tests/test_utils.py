@@ -3,11 +3,13 @@ import os
 import pytz
 import datetime
 
-from django.test import TestCase
+from django.test import RequestFactory, TestCase
 from django.utils import timezone
 
-from schedule.models import Event, Rule, Calendar
-from schedule.utils import EventListManager
+from schedule.models import Event, Rule, Calendar, Occurrence
+from schedule.middleware import TimezoneMiddleware
+from schedule.utils import (
+    EventListManager, LRUCache, find_overlaps, get_request_timezone, get_timezone, iter_busy_ranges)
 
 
 class TestEventListManager(TestCase):
@@ -50,3 +52,84 @@ class TestEventListManager(TestCase):
         self.assertEqual(next(occurrences).event, self.event1)
         occurrences = eml.occurrences_after()
         self.assertEqual(list(occurrences), [])
+
+
+class TestLRUCache(TestCase):
+    def test_eviction_and_stats(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1, 'size': 2, 'maxsize': 2})
+
+    def test_invalidate(self):
+        cache = LRUCache(10)
+        cache.set((1, 'x'), 1)
+        cache.set((2, 'x'), 2)
+        cache.invalidate(lambda key: key[0] == 1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get((2, 'x')), 2)
+
+
+class TestFindOverlaps(TestCase):
+    def test_matches_pairwise(self):
+        base = datetime.datetime(2008, 1, 1, tzinfo=pytz.utc)
+
+        def occurrences(*hours):
+            return [Occurrence(start=base + datetime.timedelta(hours=start),
+                               end=base + datetime.timedelta(hours=end)) for start, end in hours]
+        candidates = occurrences((0, 2), (3, 4), (5, 9), (10, 11))
+        others = occurrences((1, 3), (2, 6), (4, 5), (6, 7), (7, 8), (11, 12))
+        others[4].cancelled = True
+        expected = [(c, o) for c in candidates for o in others
+                    if c.start < o.end and o.start < c.end and not o.cancelled]
+        overlaps = find_overlaps(candidates, others)
+        self.assertEqual(sorted((candidates.index(c), others.index(o)) for c, o in overlaps),
+                         sorted((candidates.index(c), others.index(o)) for c, o in expected))
+        self.assertEqual(len(overlaps), 4)
+
+
+class TestBusyRanges(TestCase):
+    def test_iter_busy_ranges(self):
+        base = datetime.datetime(2008, 1, 1, tzinfo=pytz.utc)
+
+        def hours(*hours):
+            return [base + datetime.timedelta(hours=hour) for hour in hours]
+        occurrences = [Occurrence(start=start, end=end) for start, end in
+                       [hours(0, 2), hours(1, 3), hours(3, 4), hours(5, 9), hours(6, 7), hours(10, 11), hours(12, 13)]]
+        occurrences[-2].cancelled = True
+        self.assertEqual(list(iter_busy_ranges(occurrences)), [tuple(hours(0, 4)), tuple(hours(5, 9)), tuple(hours(12, 13))])
+        self.assertEqual(list(iter_busy_ranges(occurrences, *hours(1, 6))), [tuple(hours(1, 4)), tuple(hours(5, 6))])
+        self.assertEqual(list(iter_busy_ranges([], *hours(1, 6))), [])
+
+
+class TestRequestTimezone(TestCase):
+
+    def get_request(self, session=None, **params):
+        request = RequestFactory().get('/', params)
+        if session is not None:
+            request.session = session
+        return request
+
+    def test_get_timezone(self):
+        self.assertTrue(get_timezone('Europe/Paris') is get_timezone('Europe/Paris'))
+        self.assertRaises(pytz.UnknownTimeZoneError, get_timezone, 'Mars/Olympus')
+
+    def test_get_request_timezone(self):
+        session = {'django_timezone': 'Europe/Paris'}
+        self.assertEqual(get_request_timezone(self.get_request()), pytz.utc)
+        self.assertEqual(get_request_timezone(self.get_request(session)).zone, 'Europe/Paris')
+        self.assertEqual(get_request_timezone(self.get_request(session, tz='Asia/Tokyo')).zone, 'Asia/Tokyo')
+        self.assertEqual(get_request_timezone(self.get_request(session, tz='Mars/Olympus')).zone, 'Europe/Paris')
+        self.assertEqual(session, {'django_timezone': 'Europe/Paris'})
+
+    def test_middleware(self):
+        request = self.get_request(tz='Asia/Tokyo')
+        middleware = TimezoneMiddleware()
+        middleware.process_request(request)
+        self.assertEqual(timezone.get_current_timezone_name(), 'Asia/Tokyo')
+        middleware.process_response(request, None)
+        self.assertEqual(timezone.get_current_timezone(), timezone.get_default_timezone())
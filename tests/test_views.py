@@ -1,8 +1,11 @@
 from __future__ import absolute_import
+import base64
+import json
 import pytz
 import datetime
 
 from django.contrib.auth.models import User
+from django.core.cache import caches
 from django.test.utils import override_settings
 from django.test import TestCase
 from django.core.urlresolvers import reverse
@@ -12,8 +15,9 @@ from schedule.models.calendars import Calendar
 from schedule.models.events import Event
 from schedule.models.rules import Rule
 from schedule import utils
+from schedule.conf import settings
 
-from schedule.views import check_next_url, coerce_date_dict
+from schedule.views import check_next_url, coerce_date_dict, iter_json_list
 
 
 class TestViews(TestCase):
@@ -41,6 +45,196 @@ class TestViews(TestCase):
         self.client.login(username="admin", password="admin")
 
 
+    def test_api_occurrences(self):
+        response = self.client.get(reverse('api_occurences'), {
+            'calendar_slug': self.calendar.slug,
+            'start': '1201824000',  # 2008-02-01
+            'end': '1201996800',  # 2008-02-03
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([o['start'] for o in json.loads(response.content.decode('utf-8'))],
+                         ['2008-02-01T08:00:00+00:00', '2008-02-02T08:00:00+00:00'])
+
+
+    def test_api_occurrences_after(self):
+        url = reverse('api_occurrences_after')
+        params = {'calendar_slug': self.calendar.slug, 'after': '1201824000', 'limit': '40'}  # 2008-02-01
+        starts = []
+        while True:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            page = json.loads(response.content.decode('utf-8'))
+            starts += [o['start'] for o in page['occurrences']]
+            if page['next'] is None:
+                break
+            params['cursor'] = page['next']
+        self.assertEqual(len(starts), 94)
+        self.assertEqual(starts[:2], ['2008-02-01T08:00:00+00:00', '2008-02-02T08:00:00+00:00'])
+        self.assertEqual(starts[-1], '2008-05-04T08:00:00+00:00')
+
+        response = self.client.get(url, {'calendar_slug': self.calendar.slug, 'cursor': 'nope'})
+        self.assertEqual(response.status_code, 400)
+        # dates past datetime.max
+        cursor = base64.urlsafe_b64encode(b'%d,0,1,0' % (10 ** 20)).decode('ascii')
+        response = self.client.get(url, {'calendar_slug': self.calendar.slug, 'cursor': cursor})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url, {'calendar_slug': self.calendar.slug, 'after': '1e20'})
+        self.assertEqual(response.status_code, 400)
+        for limit in ('abc', ''):
+            response = self.client.get(url, {'calendar_slug': self.calendar.slug, 'limit': limit})
+            self.assertEqual(response.status_code, 400)
+
+    def test_api_occurrences_bulk(self):
+        url = reverse('api_occurrences_bulk')
+        changes = {'changes': [
+            {'event_id': self.event.pk, 'original_start': 1201852800 + day * 86400, 'action': 'cancel'}  # 2008-02-01 08:00
+            for day in range(3)]}
+        changes['changes'].append({'event_id': self.event.pk, 'original_start': 1202112000, 'action': 'move',
+                                   'start': 1202115600, 'end': 1202119200})
+        response = self.client.post(url, json.dumps(changes), content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_login(User.objects.create_user('bulk', password='bulk'))
+        response = self.client.post(url, json.dumps(changes), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        ids = [o['id'] for o in json.loads(response.content.decode('utf-8'))]
+        self.assertEqual(len(ids), 4)
+        self.assertTrue(all(isinstance(pk, int) for pk in ids))
+        self.assertEqual(len(set(ids)), 4)
+        occurrences = self.event.get_occurrences(datetime.datetime(2008, 2, 1, tzinfo=pytz.utc),
+                                                 datetime.datetime(2008, 2, 5, tzinfo=pytz.utc))
+        self.assertEqual([(o.cancelled, o.moved) for o in occurrences],
+                         [(True, False), (True, False), (True, False), (False, True)])
+
+        changes['changes'][0]['original_start'] += 60
+        response = self.client.post(url, json.dumps(changes), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_api_freebusy(self):
+        other = Calendar.objects.create(name="Other", slug='other')
+        Event.objects.create(title='Lunch', start=datetime.datetime(2008, 2, 1, 8, 30, tzinfo=pytz.utc),
+                             end=datetime.datetime(2008, 2, 1, 12, 0, tzinfo=pytz.utc), calendar=other)
+        params = {'calendar_slug': [self.calendar.slug, other.slug],
+                  'start': '1201824000', 'end': '1201996800'}  # 2008-02-01 to 2008-02-03
+        response = self.client.get(reverse('api_freebusy'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['busy'], [
+            ['2008-02-01T08:00:00+00:00', '2008-02-01T12:00:00+00:00'],
+            ['2008-02-02T08:00:00+00:00', '2008-02-02T09:00:00+00:00'],
+        ])
+
+        response = self.client.get(reverse('freebusy_ical'), params)
+        self.assertEqual(response['Content-Type'], 'text/calendar')
+        content = response.content.decode('utf-8')
+        self.assertTrue('BEGIN:VFREEBUSY' in content)
+        self.assertTrue('FREEBUSY;FBTYPE=BUSY:20080201T080000Z/20080201T120000Z' in content)
+
+        params['calendar_slug'] = 'missing'
+        self.assertEqual(self.client.get(reverse('api_freebusy'), params).status_code, 404)
+
+    def test_api_occurrences_stream(self):
+        params = {'calendar_slug': self.calendar.slug, 'start': '1201824000', 'end': '1209600000'}
+        response = self.client.get(reverse('api_occurences'), params)
+        params['stream'] = '1'
+        streamed = self.client.get(reverse('api_occurences'), params)
+        self.assertTrue(streamed.streaming)
+        occurrences = json.loads(b''.join(streamed.streaming_content).decode('utf-8'))
+        self.assertEqual(len(occurrences), 90)
+        self.assertEqual(occurrences, json.loads(response.content.decode('utf-8')))
+
+    def test_api_occurrences_conditional_get(self):
+        url = reverse('api_occurences')
+        params = {'calendar_slug': self.calendar.slug, 'start': '1201824000', 'end': '1201996800'}
+        response = self.client.get(url, params)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        # the calendar and one aggregate each for its events and occurrences
+        with self.assertNumQueries(3):
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, params, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        self.event.get_occurrences(datetime.datetime(2008, 2, 1, tzinfo=pytz.utc),
+                                   datetime.datetime(2008, 2, 3, tzinfo=pytz.utc))[0].cancel()
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        self.event.occurrence_set.all().delete()
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_get_after_rule_change(self):
+        url = reverse('api_occurences')
+        params = {'calendar_slug': self.calendar.slug, 'start': '1201824000', 'end': '1201996800'}
+        etag = self.client.get(url, params)['ETag']
+        self.rule.params = 'interval:2'
+        self.rule.save()
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content.decode('utf-8'))), 1)
+
+    def test_conditional_get_with_stale_version_cache(self):
+        url = reverse('api_occurences')
+        params = {'calendar_slug': self.calendar.slug, 'start': '1201824000', 'end': '1201996800'}
+        period_cache = settings.PERIOD_CACHE
+        settings.PERIOD_CACHE = 'default'
+        self.addCleanup(setattr, settings, 'PERIOD_CACHE', period_cache)
+        cache = caches['default']
+        cache.clear()
+        etag = self.client.get(url, params)['ETag']
+        key = utils._calendar_version_key(self.calendar.pk)
+        version = cache.get(key)
+        # another process saves the rule, this one keeps its own version
+        self.rule.params = 'interval:2'
+        self.rule.save()
+        cache.set(key, version, None)
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # or has none at all
+        etag = response['ETag']
+        self.rule.params = 'interval:3'
+        self.rule.save()
+        cache.clear()
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_calendar_conditional_get(self):
+        url = reverse('month_calendar', kwargs={'calendar_slug': self.calendar.slug})
+        response = self.client.get(url, {'year': 2008, 'month': 2})
+        response = self.client.get(url, {'year': 2008, 'month': 2}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.has_header('Last-Modified'))
+        response = self.client.get(url, {'year': 2008, 'month': 3}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_calendar_timezone(self):
+        url = reverse('month_calendar', kwargs={'calendar_slug': self.calendar.slug})
+        response = self.client.get(url, {'year': 2008, 'month': 2})
+        self.assertEqual(response.context['periods']['month'].tzinfo, pytz.utc)
+        # the session is read, not written
+        self.assertFalse('sessionid' in response.cookies)
+
+        chicago = self.client.get(url, {'year': 2008, 'month': 2, 'tz': 'America/Chicago'})
+        self.assertEqual(chicago.context['periods']['month'].tzinfo.zone, 'America/Chicago')
+        self.assertNotEqual(chicago['ETag'], response['ETag'])
+
+    def test_ical_conditional_get(self):
+        # answered before the feed is built
+        url = reverse('calendar_ical', args=[self.calendar.pk])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_iter_json_list(self):
+        self.assertEqual(list(iter_json_list([], 2)), ['[]'])
+        chunks = list(iter_json_list([{'a': 1}, 2, 'b', None, 5], 2))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(json.loads(''.join(chunks)), [{'a': 1}, 2, 'b', None, 5])
+
+
 class TestViewUtils(TestCase):
     def test_check_next_url(self):
         url = "http://thauber.com"
@@ -96,6 +290,19 @@ class TestUrls(TestCase):
                          (datetime.datetime(2000, 11, 1, 0, 0, tzinfo=pytz.utc),
                           datetime.datetime(2000, 12, 1, 0, 0, tzinfo=pytz.utc)))
 
+    def test_calendar_month_view_overlay(self):
+        calendar = Calendar.objects.create(name="Other", slug='other')
+        start = datetime.datetime(2000, 11, 2, 8, 0, tzinfo=pytz.utc)
+        Event.objects.create(title='Overlaid', start=start, end=start + datetime.timedelta(hours=1),
+                             calendar=calendar)
+        self.response = self.client.get(reverse("month_calendar", kwargs={"calendar_slug": 'example'}),
+                                        {'year': 2000, 'month': 11, 'overlay': 'other'})
+        self.assertEqual(self.response.status_code, 200)
+        self.assertEqual([c.slug for c in self.response.context[0]["calendars"]], ['example', 'other'])
+        occurrences = self.response.context[0]["periods"]['month'].get_occurrences()
+        self.assertEqual([(o.title, o.calendar.slug) for o in occurrences if o.calendar.slug == 'other'],
+                         [('Overlaid', 'other')])
+
     def test_event_creation_anonymous_user(self):
         self.response = self.client.get(reverse("calendar_create_event",
                                       kwargs={"calendar_slug": 'example'}), {})